@@ -11,7 +11,8 @@ from __future__ import absolute_import, unicode_literals
 
 
 def execute(context, service, *args):
-    return context.broker.execute(service, *args).result
+    # Forward the result as it is, without decoding it.
+    return context.broker.execute(service, *args).encoded_result
 
 
 def main():
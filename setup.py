@@ -7,7 +7,20 @@
 # granted to it by virtue of its status as an intergovernmental organisation
 # nor does it submit to any jurisdiction.
 
+import sys
+
 from setuptools import find_packages, setup
+from setuptools.command.build_py import build_py as _build_py
+
+
+class build_py(_build_py):
+    def find_package_modules(self, package, package_dir):
+        modules = _build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info[0] < 3:
+            # `servicelib.aio` uses ``async`` and ``await``, which Python 2
+            # cannot even byte-compile.
+            modules = [m for m in modules if m[:2] != ("servicelib", "aio")]
+        return modules
 
 
 setup(
@@ -26,6 +39,7 @@ setup(
         "Programming Language :: Python :: Implementation :: CPython",
         "Topic :: Software Development :: Libraries :: Application Frameworks",
     ],
+    cmdclass={"build_py": build_py},
     entry_points={
         "console_scripts": [
             "servicelib-client=servicelib.cmd.client:main",
@@ -36,6 +50,8 @@ setup(
     },
     extras_require={
         "docs": ["sphinx"],
+        "json": ['orjson; python_version >= "3.6"'],
+        "msgpack": ["msgpack>=1.0"],
         "tests": [
             "coverage[toml]<5.0",
             "pyflakes",
@@ -49,6 +65,7 @@ setup(
     include_package_data=True,
     install_requires=[
         "falcon",
+        'futures; python_version < "3"',
         "psutil",
         "python-json-logger",
         "python-memcached",
@@ -0,0 +1,368 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""Client code for calling services from ``asyncio`` programs.
+
+Requires Python 3.
+
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import os
+import socket
+import sys
+import time
+
+from servicelib import balancer, circuit, config, core, errors, logutils, registry
+from servicelib.client import (
+    check_args,
+    check_timeout,
+    data_hosts,
+    get_default_timeout,
+)
+from servicelib.compat import urlparse
+from servicelib.context import Context
+from servicelib.context.client import ClientContext
+from servicelib.timer import Timer
+
+
+__all__ = [
+    "AsyncBroker",
+    "AsyncResult",
+]
+
+
+DEFAULT_POOL_MAXSIZE = 100
+
+
+class HttpError(Exception):
+    pass
+
+
+_DEFAULT_PORTS = {
+    "http": 80,
+    "https": 443,
+}
+
+
+class ConnectionPool(object):
+
+    """A pool of keep-alive HTTP connections, grouped by host.
+
+    At most ``maxsize`` connections per host are open at any given time.
+    Connections to the same host and port with and without TLS are kept
+    apart.
+
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._idle = {}
+        self._slots = {}
+
+    async def acquire(self, host, port, ssl=False):
+        k = (host, port, ssl)
+        slots = self._slots.get(k)
+        if slots is None:
+            self._slots[k] = slots = asyncio.Semaphore(self.maxsize)
+        await slots.acquire()
+        try:
+            idle = self._idle.setdefault(k, [])
+            while idle:
+                reader, writer = idle.pop()
+                if not reader.at_eof() and not writer.is_closing():
+                    return reader, writer, True
+                writer.close()
+            reader, writer = await asyncio.open_connection(host, port, ssl=ssl)
+            return reader, writer, False
+        except BaseException:
+            slots.release()
+            raise
+
+    def release(self, host, port, ssl, reader, writer, reuse):
+        k = (host, port, ssl)
+        if reuse:
+            self._idle.setdefault(k, []).append((reader, writer))
+        else:
+            writer.close()
+        self._slots[k].release()
+
+    def close(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                try:
+                    writer.close()
+                except RuntimeError:
+                    # The loop is closed already (e.g. after
+                    # `asyncio.run()`), so the transport cannot schedule
+                    # its own closing. Hang up on the peer ourselves.
+                    try:
+                        writer.get_extra_info("socket").shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+        self._idle.clear()
+
+
+async def _read_headers(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise HttpError("Connection closed by peer")
+    bits = status_line.decode("latin-1").split(None, 2)
+    if len(bits) < 2 or not bits[0].startswith("HTTP/"):
+        raise HttpError("Invalid status line: {!r}".format(status_line))
+    version, status = bits[0], int(bits[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        k, _, v = line.decode("latin-1").partition(":")
+        headers[k.strip().lower()] = v.strip()
+
+    return version, status, headers
+
+
+async def _read_body(reader, headers):
+    """Returns a pair ``(body, complete)``.
+
+    ``complete`` is false when the end of the body was signalled by the peer
+    closing the connection.
+
+    """
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip(), 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        return b"".join(chunks), True
+
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"])), True
+
+    return await reader.read(), False
+
+
+class AsyncResult(object):
+
+    """Awaitable handle on a service call made through `AsyncBroker`.
+
+    Awaiting it returns the result of the call, and ``await wait()`` returns a
+    ``(result, metadata)`` pair, like `servicelib.client.Result.wait()` does.
+
+    The URL of the service is looked up in the registry once the call runs,
+    so errors doing so are raised when awaiting.
+
+    """
+
+    log = logutils.get_logger(__name__)
+
+    _default_timeout = None
+
+    def __init__(self, pool, service, args, kwargs, context):
+        self.pool = pool
+        self.timeout = check_timeout(kwargs.pop("timeout", self.default_timeout))
+        self.args = args
+        self.kwargs = dict(kwargs)
+        self.service = service
+        self.url = None
+        self.id = core.call_id()
+        if context is None:
+            context = ClientContext(self.id)
+        self.context = context
+        self.timer = Timer()
+        self._task = asyncio.get_running_loop().create_task(self._runner())
+
+    async def _post(self, req):
+        u = urlparse(self.url)
+        if u.scheme not in _DEFAULT_PORTS:
+            raise HttpError("Unsupported URL scheme: {}".format(self.url))
+        host, port = u.hostname, u.port or _DEFAULT_PORTS[u.scheme]
+        ssl = u.scheme == "https"
+        path = u.path or "/"
+        if u.query:
+            path = "{}?{}".format(path, u.query)
+
+        body = req.http_body.encode("utf-8")
+        head = [
+            "POST {} HTTP/1.1".format(path),
+            "Host: {}".format(u.netloc),
+            "Content-Type: application/json",
+            "Content-Length: {}".format(len(body)),
+        ]
+        head.extend("{}: {}".format(k, v) for k, v in req.http_headers.items())
+        head = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1")
+
+        while True:
+            reader, writer, reused = await self.pool.acquire(host, port, ssl)
+            reuse = False
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                version, status, headers = await _read_headers(reader)
+            except (HttpError, ConnectionError):
+                # The peer may have closed an idle connection before we
+                # noticed. Try again with a fresh one.
+                self.pool.release(host, port, ssl, reader, writer, False)
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                self.pool.release(host, port, ssl, reader, writer, False)
+                raise
+
+            try:
+                res_body, complete = await _read_body(reader, headers)
+                keep_alive = headers.get("connection", "").lower()
+                if version == "HTTP/1.0":
+                    reuse = complete and keep_alive == "keep-alive"
+                else:
+                    reuse = complete and keep_alive != "close"
+            finally:
+                self.pool.release(host, port, ssl, reader, writer, reuse)
+
+            return status, res_body, headers
+
+    def _service_url(self):
+        return registry.instance().service_url(
+            self.service, hosts=data_hosts(self.args, self.kwargs)
+        )
+
+    async def _runner(self):
+        self.timer.start()
+        try:
+            # The registry may have to ask Redis, which would block the loop.
+            loop = asyncio.get_running_loop()
+            self.url = await loop.run_in_executor(None, self._service_url)
+        except Exception as exc:
+            self.log.info("%r: Cannot resolve service URL: %s", self, exc)
+            exc.metadata = self.context.metadata
+            return exc
+
+        started = time.time()
+        balancer.load().started(self.url)
+        try:
+            req = core.Request(*self.args, **self.kwargs)
+            self.log.debug(
+                "POST %s, headers: %s, body: %s",
+                self.url,
+                req.http_headers,
+                req.http_body,
+            )
+            status, body, headers = await asyncio.wait_for(
+                self._post(req), self.timeout
+            )
+            res = core.Response.from_http(status, body, headers)
+            self.log.debug("Response: %r", res)
+            self.timer.stop()
+            self.context.update_metadata(res.metadata)
+        except asyncio.TimeoutError as exc:
+            self.log.debug("Got timeout error: %s", exc)
+            res = errors.Timeout(self.url)
+        except Exception as exc:
+            self.log.info(
+                "%r failed: %s", self, exc, exc_info=True, stack_info=True,
+            )
+            res = exc
+
+        balancer.load().finished(self.url, time.time() - started)
+        circuit.breakers().record(self.url, res)
+        res.metadata = self.context.metadata
+        return res
+
+    async def wait(self, timeout=None):
+        try:
+            res = await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            raise errors.Timeout(self.url)
+
+        if isinstance(res, Exception):
+            raise res
+
+        result = res.value
+        if isinstance(result, Exception):
+            raise result
+
+        return result, res.metadata
+
+    async def _result(self):
+        r, _ = await self.wait()
+        return r
+
+    def __await__(self):
+        return self._result().__await__()
+
+    @property
+    def metadata(self):
+        if not self._task.done():
+            raise Exception("{!r} has not completed yet".format(self))
+        return self._task.result().metadata
+
+    def __repr__(self):
+        return "AsyncResult(%r, %r)" % (self.url, self.args,)
+
+    @property
+    def default_timeout(self):
+        if self.__class__._default_timeout is None:
+            self.__class__._default_timeout = get_default_timeout()
+        return self.__class__._default_timeout
+
+
+class AsyncBroker(object):
+
+    """Counterpart of `servicelib.client.Broker` for ``asyncio`` programs.
+
+    Method `execute()` must be called with an event loop running. All calls
+    made through the same broker share a pool of keep-alive connections.
+
+    """
+
+    def __init__(self, thing=None, **kwargs):
+        self.pool = ConnectionPool(
+            int(config.get("client.async_pool_maxsize", default=DEFAULT_POOL_MAXSIZE))
+        )
+        if isinstance(thing, Context):
+            self._context = thing
+            self._kwargs = None
+        else:
+            self._context = None
+            self._kwargs = kwargs
+
+    @property
+    def context(self):
+        if self._context is not None:
+            return self._context
+
+        name, _ = os.path.splitext(os.path.basename(sys.argv[0]))
+        return ClientContext(name, **self._kwargs)
+
+    def execute(self, service_name, *args, **kwargs):
+        try:
+            context = kwargs["context"]
+            if context is None:
+                context = self.context
+            del kwargs["context"]
+        except KeyError:
+            context = self.context
+        context.pre_execute_hook(self, service_name, args, kwargs)
+
+        check_args(args)
+        check_args(kwargs)
+
+        return AsyncResult(self.pool, service_name, args, kwargs, context)
+
+    def close(self):
+        self.pool.close()
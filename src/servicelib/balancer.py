@@ -0,0 +1,192 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""Client-side load balancing between the workers hosting a service.
+
+The balancer in use is chosen with the ``registry.balancer`` config setting.
+
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import random
+import threading
+
+from servicelib import config
+from servicelib.compat import urlparse
+
+
+__all__ = [
+    "Balancer",
+    "Load",
+    "instance",
+    "load",
+]
+
+
+DEFAULT_EWMA_ALPHA = 0.3
+
+
+class Load(object):
+
+    """Keeps track of the number of in-flight calls to each worker URL, and of
+    an exponentially weighted moving average of their latencies.
+
+    """
+
+    def __init__(self, alpha=DEFAULT_EWMA_ALPHA):
+        self.alpha = alpha
+        self._in_flight = {}
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def started(self, url):
+        with self._lock:
+            self._in_flight[url] = self._in_flight.get(url, 0) + 1
+
+    def finished(self, url, elapsed):
+        with self._lock:
+            self._in_flight[url] = max(0, self._in_flight.get(url, 0) - 1)
+            prev = self._latency.get(url)
+            if prev is None:
+                self._latency[url] = elapsed
+            else:
+                self._latency[url] = prev + self.alpha * (elapsed - prev)
+
+    def in_flight(self, url):
+        with self._lock:
+            return self._in_flight.get(url, 0)
+
+    def latency(self, url):
+        """Returns the average latency of calls to `url`, or 0 if unknown."""
+        with self._lock:
+            return self._latency.get(url, 0.0)
+
+
+_LOAD = Load()
+
+
+def load():
+    """Returns the load of the worker URLs called by this process."""
+    return _LOAD
+
+
+class Balancer(object):
+    def order(self, urls):
+        """Returns `urls` sorted in order of preference.
+
+        The registry picks the first one whose circuit is not open.
+
+        """
+        raise NotImplementedError
+
+
+class RandomBalancer(Balancer):
+
+    """Picks workers uniformly at random."""
+
+    def order(self, urls):
+        ret = list(urls)
+        random.shuffle(ret)
+        return ret
+
+
+class LeastOutstandingBalancer(Balancer):
+
+    """Prefers the workers with the fewest in-flight calls, then the fastest
+    ones.
+
+    """
+
+    def order(self, urls):
+        ret = list(urls)
+        # Shuffle first, so that ties are broken randomly.
+        random.shuffle(ret)
+        ld = load()
+        ret.sort(key=lambda u: (ld.in_flight(u), ld.latency(u)))
+        return ret
+
+
+class PowerOfTwoBalancer(Balancer):
+
+    """Picks two workers at random, and prefers the least loaded of them.
+
+    The load of a worker is its average latency, weighted by the number of
+    calls in flight to it.
+
+    """
+
+    def order(self, urls):
+        ret = list(urls)
+        random.shuffle(ret)
+        if len(ret) > 1 and self.cost(ret[1]) < self.cost(ret[0]):
+            ret[0], ret[1] = ret[1], ret[0]
+        return ret
+
+    def cost(self, url):
+        ld = load()
+        n = ld.in_flight(url)
+        return ((n + 1) * ld.latency(url), n)
+
+
+class CapacityBalancer(Balancer):
+
+    """Picks workers at random, with probabilities proportional to their spare
+    capacity, as published by the workers themselves (see
+    `servicelib.registry.Registry.worker_load()`).
+
+    The spare capacity of a worker is the number of requests it may handle
+    on top of those it is already handling or has queued, scaled down by the
+    CPU usage of its host. Workers which have not published their load are
+    given the average spare capacity of the others.
+
+    """
+
+    MIN_WEIGHT = 0.01
+
+    def order(self, urls):
+        # Imported here, as the registry module depends on this one.
+        from servicelib import registry
+
+        r = registry.instance()
+        weights = [self.weight(r.worker_load(urlparse(u).netloc)) for u in urls]
+        known = [w for w in weights if w is not None]
+        default = sum(known) / len(known) if known else 1.0
+        weights = [default if w is None else w for w in weights]
+
+        # Weighted random sampling without replacement (Efraimidis and
+        # Spirakis).
+        keys = [random.random() ** (1.0 / w) for w in weights]
+        return [u for (_, u) in sorted(zip(keys, urls), reverse=True)]
+
+    def weight(self, load):
+        if load is None:
+            return None
+        spare = load["capacity"] - load["busy"] - load["queue"]
+        idle_cpu = 1.0 - min(load["cpu"], 100.0) / 100.0
+        return max(spare * idle_cpu, self.MIN_WEIGHT)
+
+
+_INSTANCE_MAP = {
+    "capacity": CapacityBalancer,
+    "least-outstanding": LeastOutstandingBalancer,
+    "power-of-two": PowerOfTwoBalancer,
+    "random": RandomBalancer,
+}
+
+
+def instance():
+    class_name = config.get("registry.balancer", default="random")
+    try:
+        ret = _INSTANCE_MAP[class_name]
+    except KeyError:
+        raise Exception("Invalid value for `registry.balancer`: {}".format(class_name))
+    if isinstance(ret, type):
+        _INSTANCE_MAP[class_name] = ret = ret()
+    return ret
@@ -0,0 +1,174 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""Client-side circuit breakers for worker URLs."""
+
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+
+from servicelib import config, logutils
+
+
+__all__ = [
+    "CircuitBreaker",
+    "CircuitBreakers",
+    "breakers",
+    "is_failure",
+]
+
+
+DEFAULT_FAILURE_THRESHOLD = 5
+
+DEFAULT_RESET_TIMEOUT = 30.0
+
+
+def is_failure(res):
+    """Returns true if `res`, the outcome of a call, means the worker which
+    handled it may be unhealthy.
+
+    `res` is either a `servicelib.core.Response` or an exception. Errors
+    returned by the service itself do not count as failures, since the worker
+    was able to reply; timeouts and communication errors do.
+
+    """
+    return isinstance(res, Exception)
+
+
+class CircuitBreaker(object):
+
+    """Tracks the health of a worker URL.
+
+    The circuit opens after `failure_threshold` consecutive failures, and
+    calls are not sent to the URL while it is open. After `reset_timeout`
+    seconds the circuit becomes half-open, and a single probe call is let
+    through: if it succeeds the circuit closes, otherwise it opens again.
+
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    log = logutils.get_logger(__name__)
+
+    def __init__(self, url, failure_threshold, reset_timeout):
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns true if a call may be sent to this URL now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            now = time.time()
+            if self.state == self.OPEN:
+                if now < self._opened_at + self.reset_timeout:
+                    return False
+                self.log.info("Circuit for %s is now half-open", self.url)
+                self.state = self.HALF_OPEN
+                self._probe_at = None
+
+            # Half-open: let a single probe through. Should it never report
+            # back, let another one through after a while.
+            if self._probe_at is None or now > self._probe_at + self.reset_timeout:
+                self._probe_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                self.log.info("Circuit for %s is now closed", self.url)
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.log.warning(
+                    "Circuit for %s is now open (%s consecutive failures)",
+                    self.url,
+                    self.failures,
+                )
+                self.state = self.OPEN
+                self._opened_at = time.time()
+
+    def __repr__(self):
+        return "CircuitBreaker({!r}, state={!r}, failures={!r})".format(
+            self.url, self.state, self.failures
+        )
+
+
+class CircuitBreakers(object):
+
+    """The circuit breakers of all worker URLs called by this process.
+
+    Circuit breaking is disabled when `failure_threshold` is 0.
+
+    """
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        if failure_threshold is None:
+            failure_threshold = config.get(
+                "client.circuit_breaker.failure_threshold",
+                default=DEFAULT_FAILURE_THRESHOLD,
+            )
+        if reset_timeout is None:
+            reset_timeout = config.get(
+                "client.circuit_breaker.reset_timeout", default=DEFAULT_RESET_TIMEOUT
+            )
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            ret = self._breakers.get(url)
+            if ret is None:
+                ret = CircuitBreaker(url, self.failure_threshold, self.reset_timeout)
+                self._breakers[url] = ret
+        return ret
+
+    def allow(self, url):
+        if self.failure_threshold <= 0:
+            return True
+        return self.get(url).allow()
+
+    def record(self, url, res):
+        """Updates the circuit of `url` with `res`, the outcome of a call."""
+        if self.failure_threshold <= 0:
+            return
+        if is_failure(res):
+            self.get(url).record_failure()
+        else:
+            self.get(url).record_success()
+
+
+_BREAKERS = None
+
+
+def breakers():
+    """Returns the circuit breakers of this process."""
+    global _BREAKERS
+    if _BREAKERS is None:
+        _BREAKERS = CircuitBreakers()
+    return _BREAKERS
@@ -9,26 +9,59 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
 import os
 import sys
 import threading
+import time
+
+from concurrent import futures
 
 import requests
+import six
+
 
-from servicelib import config, core, errors, logutils, registry
-from servicelib.compat import string_types
+from servicelib import (
+    balancer,
+    circuit,
+    config,
+    core,
+    errors,
+    hedging,
+    logutils,
+    registry,
+    retry,
+    unix,
+)
+from servicelib import encoding as json
+from servicelib.compat import string_types, urlparse
 from servicelib.context import Context
 from servicelib.context.client import ClientContext
+from servicelib.results import result_hosts
+from servicelib.service import service_instances
 from servicelib.timer import Timer
 
 
 __all__ = [
+    "BatchResult",
     "Broker",
+    "DaemonThreadPoolExecutor",
+    "HttpTransport",
     "Result",
     "check_args",
+    "executor",
+    "local_executor",
+    "transport",
 ]
 
 
+DEFAULT_MAX_WORKERS = 64
+
+DEFAULT_POOL_CONNECTIONS = 100
+
+DEFAULT_POOL_MAXSIZE = 10
+
+
 def check_args(a, name=""):
     if a is None:
         pass
@@ -60,85 +93,721 @@ def get_default_timeout():
     return config.get("client.default_timeout", default=None)
 
 
+def get_max_workers():
+    return int(config.get("client.max_workers", default=DEFAULT_MAX_WORKERS))
+
+
+def local_instance(service_name):
+    """Returns the instance of service `service_name` hosted by this process,
+    if any, unless ``client.in_process`` is false.
+
+    Calls to such services skip HTTP altogether. They run on
+    `local_executor()`, and are not limited to the threads of the worker.
+
+    """
+    if not config.get("client.in_process", default=True):
+        return None
+    return service_instances().get(service_name)
+
+
+def socket_url(url):
+    """Returns the URL to send requests for `url` to.
+
+    That is `url` itself, unless it points to a worker on this host which
+    listens on a Unix socket as well (see
+    `servicelib.registry.Registry.register_socket()`). Set
+    ``client.unix_sockets`` to false to always use TCP.
+
+    """
+    if not registry.is_local(url):
+        return url
+    if not config.get("client.unix_sockets", default=True):
+        return url
+    path = registry.instance().socket_path(urlparse(url).netloc)
+    if path is None or not os.path.exists(path):
+        return url
+    return unix.unix_url(path, url)
+
+
+def http_headers(thing, media_type):
+    """Returns the HTTP headers of `thing`, a `servicelib.core.Request` or
+    `servicelib.core.Response` whose body is encoded in `media_type`.
+
+    """
+    if json.is_envelope(media_type):
+        return {}
+    return thing.http_headers
+
+
+class MediaTypes(object):
+
+    """Keeps track of the media types in which to send request bodies to each
+    worker URL.
+
+    Requests are sent as JSON, which all workers accept, with an ``Accept``
+    header listing the media types this process can decode (see
+    `servicelib.encoding.media_types()`). Once a worker replies in one of
+    them, further request bodies sent to it use it too. Should a worker then
+    reject one (say, after a downgrade), we go back to JSON.
+
+    """
+
+    def __init__(self):
+        self._request_types = {}
+        self._lock = threading.Lock()
+
+    @property
+    def accept(self):
+        """The value of the ``Accept`` header of requests."""
+        ret = []
+        for i, media_type in enumerate(json.media_types()):
+            if i > 0:
+                media_type = "{};q={:.1f}".format(media_type, max(1.0 - i / 10.0, 0.1))
+            ret.append(media_type)
+        return ", ".join(ret)
+
+    def request_type(self, url):
+        with self._lock:
+            return self._request_types.get(url, json.JSON)
+
+    def replied(self, url, media_type):
+        if media_type in json.media_types():
+            with self._lock:
+                self._request_types[url] = media_type
+
+    def rejected(self, url):
+        with self._lock:
+            self._request_types.pop(url, None)
+
+
+_MEDIA_TYPES = MediaTypes()
+
+
+def media_types():
+    """Returns the media types in which to talk to worker URLs."""
+    return _MEDIA_TYPES
+
+
+def data_hosts(args, kwargs):
+    """Returns the hosts holding results passed in `args` or `kwargs`.
+
+    Calls are routed to workers on those hosts, if any, so that they do not
+    have to download their inputs. Set ``client.data_locality`` to false to
+    disable this.
+
+    """
+    if not config.get("client.data_locality", default=True):
+        return set()
+    return result_hosts([args, kwargs])
+
+
+class DaemonThreadPoolExecutor(futures.Executor):
+
+    """A thread pool like `futures.ThreadPoolExecutor`, whose threads do not
+    keep the process alive.
+
+    `futures.ThreadPoolExecutor` joins its threads at exit, so that a process
+    would wait for pending calls, forever if some worker hangs and there is
+    no timeout.
+
+    There is no limit to the number of threads if `max_workers` is ``None``.
+
+    """
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._queue = six.moves.queue.Queue()
+        self._threads = []
+        self._idle = threading.Semaphore(0)
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot schedule new futures after shutdown")
+            future = futures.Future()
+            self._queue.put((future, fn, args, kwargs))
+            if not self._idle.acquire(False) and (
+                self._max_workers is None or len(self._threads) < self._max_workers
+            ):
+                t = threading.Thread(
+                    target=self._work,
+                    name="servicelib-client-{}".format(len(self._threads)),
+                )
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+            return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+            del future, fn, args, kwargs, item
+            self._idle.release()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+            for _ in self._threads:
+                self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+
+
+_EXECUTOR = None
+_EXECUTOR_PID = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def executor():
+    """Returns the thread pool which runs service calls in this process.
+
+    The pool is created on first use, with ``client.max_workers`` threads. It
+    is created anew after a ``fork()``, since threads do not survive it.
+
+    Its threads are daemons: calls still pending when the process exits are
+    abandoned.
+
+    """
+    global _EXECUTOR, _EXECUTOR_PID
+
+    with _EXECUTOR_LOCK:
+        pid = os.getpid()
+        if _EXECUTOR is None or _EXECUTOR_PID != pid:
+            _EXECUTOR = DaemonThreadPoolExecutor(get_max_workers())
+            _EXECUTOR_PID = pid
+        return _EXECUTOR
+
+
+_LOCAL_EXECUTOR = None
+_LOCAL_EXECUTOR_PID = None
+
+
+def local_executor():
+    """Returns the thread pool which runs calls to services hosted by this
+    process (see `local_instance()`).
+
+    Those services may call others hosted here as well, and wait for them, so
+    the pool has no limit on its number of threads. Otherwise nested calls
+    could take up every thread of the pool while waiting for calls queued
+    behind them.
+
+    This means that a service hosted here runs as many calls at once as
+    there are in flight, whatever the number of threads of the worker. Set
+    ``client.in_process`` to false for services which are not thread-safe.
+
+    """
+    global _LOCAL_EXECUTOR, _LOCAL_EXECUTOR_PID
+
+    with _EXECUTOR_LOCK:
+        pid = os.getpid()
+        if _LOCAL_EXECUTOR is None or _LOCAL_EXECUTOR_PID != pid:
+            _LOCAL_EXECUTOR = DaemonThreadPoolExecutor(None)
+            _LOCAL_EXECUTOR_PID = pid
+        return _LOCAL_EXECUTOR
+
+
+class HttpTransport(object):
+
+    """Hands out one `requests.Session` per thread.
+
+    `requests.Session` is not guaranteed to be thread-safe, so threads do not
+    share them. Each session keeps connection pools for up to
+    ``client.pool_connections`` hosts, with up to ``client.pool_maxsize``
+    keep-alive connections each.
+
+    """
+
+    log = logutils.get_logger(__name__)
+
+    def __init__(self, pool_connections=None, pool_maxsize=None):
+        if pool_connections is None:
+            pool_connections = config.get(
+                "client.pool_connections", default=DEFAULT_POOL_CONNECTIONS
+            )
+        if pool_maxsize is None:
+            pool_maxsize = config.get(
+                "client.pool_maxsize", default=DEFAULT_POOL_MAXSIZE
+            )
+        self.pool_connections = int(pool_connections)
+        self.pool_maxsize = int(pool_maxsize)
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The `requests.Session` of the calling thread."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = hedging.CancellableAdapter(
+                pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.mount(
+                "http+unix://", unix.UnixAdapter(pool_maxsize=self.pool_maxsize)
+            )
+            self._local.session = session
+            with self._lock:
+                # Drop the sessions of threads which are gone.
+                for t, s in self._sessions:
+                    if not t.is_alive():
+                        s.close()
+                self._sessions = [(t, s) for (t, s) in self._sessions if t.is_alive()]
+                self._sessions.append((threading.current_thread(), session))
+        return session
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def stats(self):
+        """Returns connection pool counters, keyed by ``scheme://host:port``.
+
+        For each key, ``hits`` is the number of requests sent over a reused
+        keep-alive connection, and ``misses`` the number of connections
+        opened.
+
+        """
+        with self._lock:
+            sessions = [s for (_, s) in self._sessions]
+
+        ret = {}
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for k in pools.keys():
+                    try:
+                        pool = pools[k]
+                    except KeyError:
+                        continue
+                    counters = ret.setdefault(
+                        "{}://{}:{}".format(pool.scheme, pool.host, pool.port),
+                        {"hits": 0, "misses": 0},
+                    )
+                    counters["hits"] += pool.num_requests - pool.num_connections
+                    counters["misses"] += pool.num_connections
+                for path, pool in list(getattr(adapter, "unix_pools", {}).items()):
+                    counters = ret.setdefault(
+                        "http+unix://{}".format(path), {"hits": 0, "misses": 0}
+                    )
+                    counters["hits"] += pool.num_requests - pool.num_connections
+                    counters["misses"] += pool.num_connections
+        return ret
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for _, session in sessions:
+            session.close()
+
+
+_TRANSPORT = None
+_TRANSPORT_PID = None
+_TRANSPORT_LOCK = threading.Lock()
+
+
+def transport():
+    """Returns the `HttpTransport` shared by all brokers in this process.
+
+    Sharing it lets calls made while serving different requests reuse the
+    same keep-alive connections. Like `executor()`, it is created anew after
+    a ``fork()``.
+
+    """
+    global _TRANSPORT, _TRANSPORT_PID
+
+    with _TRANSPORT_LOCK:
+        pid = os.getpid()
+        if _TRANSPORT is None or _TRANSPORT_PID != pid:
+            _TRANSPORT = HttpTransport()
+            _TRANSPORT_PID = pid
+        return _TRANSPORT
+
+
 class Result(object):
 
     log = logutils.get_logger(__name__)
 
     _default_timeout = None
 
-    def __init__(self, http_session, service, args, kwargs, context):
-        self.http_session = http_session
+    def __init__(
+        self,
+        transport,
+        service,
+        args,
+        kwargs,
+        context,
+        executor,
+        retry_policy=None,
+        hedge=None,
+    ):
+        self.transport = transport
+        self.service = service
         self.timeout = check_timeout(kwargs.pop("timeout", self.default_timeout))
+        self.deadline = check_timeout(kwargs.pop("deadline", None))
+        if self.deadline is not None:
+            self._deadline_at = time.time() + self.deadline
+        if retry_policy is None:
+            retry_policy = retry.default_policy()
+        self.retry_policy = retry_policy
+        self.hedge = hedge
+        self.hedge_winner = None
         self.args = args
         self.kwargs = dict(kwargs)
-        # local_only = self.kwargs.pop("local_only", False)
-        # self.url = registry.instance().service_url(service, local_only=local_only)
-        self.url = registry.instance().service_url(service)
+        self.instance = local_instance(service)
+        if self.instance is not None:
+            self.hedge = None
+            self.hosts = set()
+            self.url = "local:{}".format(service)
+        else:
+            self.hosts = data_hosts(args, self.kwargs)
+            self.url = registry.instance().service_url(service, hosts=self.hosts)
         self.id = core.call_id()
         if context is None:
             context = ClientContext(self.id)
         self.context = context
         self.timer = Timer()
+        self.queue_timer = Timer()
+        self.attempt_timers = []
 
         self._response = None
-        self._thread = t = threading.Thread(target=self._runner)
-        t.setDaemon(True)
-        t.start()
+        self.call_metadata = None
+        if executor is not None:
+            self._submit(executor)
+
+    def _submit(self, executor):
+        if self.instance is not None:
+            executor = local_executor()
+        self._executor = executor
+        self.queue_timer.start()
+        self._future = executor.submit(self._runner)
 
     def _runner(self):
+        self.queue_timer.stop()
         self.timer.start()
+
+        deadline = None
+        if self.deadline is not None:
+            deadline = self._deadline_at
+
+        tried = []
+        while True:
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    res = errors.Timeout(self.url)
+                    break
+                if timeout is None or timeout > remaining:
+                    timeout = remaining
+
+            timer = Timer()
+            with timer:
+                if self.hedge is None:
+                    res = self._attempt(self.url, timeout)
+                else:
+                    res = self._hedged_attempt(timeout)
+            self.attempt_timers.append(timer)
+            if self.hedge is not None and isinstance(res, core.Response):
+                hedging.latencies().record(self.service, timer.elapsed)
+
+            exc = res
+            if isinstance(res, core.Response) and res.http_status != 200:
+                # Do not decode successful responses here, callers may not
+                # need to.
+                exc = res.value
+            if not isinstance(exc, Exception):
+                break
+
+            attempt = len(self.attempt_timers)
+            if not self.retry_policy.should_retry(exc, attempt):
+                break
+            delay = self.retry_policy.delay(exc, attempt)
+            if deadline is not None and time.time() + delay >= deadline:
+                break
+
+            self.log.info(
+                "%r: Attempt %s failed (%s), retrying in %.3f s",
+                self,
+                attempt,
+                exc,
+                delay,
+            )
+            time.sleep(delay)
+
+            if self.instance is not None:
+                continue
+
+            # Try some other worker, if there is one.
+            tried.append(self.url)
+            try:
+                self.url = registry.instance().service_url(
+                    self.service, exclude=tried, hosts=self.hosts
+                )
+            except errors.CommError as exc:
+                # Every worker is unhealthy, don't insist.
+                self.log.info("%r: Cannot retry: %s", self, exc)
+                break
+            except Exception as exc:
+                self.log.info("%r: Cannot resolve service URL: %s", self, exc)
+
+        self.timer.stop()
+        self._done(res)
+
+    def _hedged_attempt(self, timeout):
+        """Sends the request to `self.url` and, if there is no response
+        within the hedging delay, to some other worker as well.
+
+        Returns the first response received, and cancels the other request.
+        If both requests fail, returns the outcome of the first one.
+
+        The first request is sent from the calling thread, and the second
+        one from the executor of this call.
+
+        """
+        try:
+            delay = hedging.hedge_delay(self.service, self.hedge)
+            hedge_url = None
+            if delay is not None:
+                hedge_url = registry.instance().service_url(
+                    self.service, exclude=[self.url]
+                )
+        except Exception as exc:
+            self.log.info("%r: Cannot hedge: %s", self, exc)
+            hedge_url = None
+        if hedge_url is None or hedge_url == self.url:
+            return self._attempt(self.url, timeout)
+
+        # The primary request is sent from this thread, the hedge from the
+        # executor. Whichever gets a response first cancels the other.
+        primary, hedge = hedging.Cancellation(), hedging.Cancellation()
+        primary_done = threading.Event()
+        hedge_started = threading.Event()
+        lock = threading.Lock()
+        winner = []
+
+        def won(name, res, other):
+            with lock:
+                if not winner and isinstance(res, core.Response):
+                    winner.append(name)
+                    other.cancel()
+                return winner == [name]
+
+        def run_hedge():
+            if primary_done.wait(delay):
+                return None
+            self.log.debug("%r: Hedging to %s", self, hedge_url)
+            hedge_started.set()
+            res = self._attempt(hedge_url, timeout, hedge)
+            won("hedge", res, primary)
+            return res
+
+        hedge_future = self._executor.submit(run_hedge)
+        res = self._attempt(self.url, timeout, primary)
+        primary_done.set()
+        if not won("primary", res, hedge) and not hedge_future.cancel():
+            # Either the hedge won, or it is running and the primary failed.
+            # It finishes at the latest when its own timeout expires.
+            hedge_res = hedge_future.result()
+            if winner == ["hedge"]:
+                self.url = hedge_url
+                res = hedge_res
+        hedge_future.cancel()
+
+        if hedge_started.is_set():
+            self.hedge_winner = winner[0] if winner else "primary"
+        return res
+
+    def _attempt(self, url, timeout, cancellation=None):
+        """Sends the request to `url`, and returns the response or the
+        exception raised.
+
+        Requests may be cancelled through `cancellation`, a
+        `servicelib.hedging.Cancellation`.
+
+        """
+        if self.instance is not None:
+            return self._local_attempt(timeout)
+
+        if cancellation is None:
+            cancellation = hedging.Cancellation()
+
+        load = balancer.load()
+        load.started(url)
+        timer = Timer()
+        timer.start()
         try:
             req = core.Request(*self.args, **self.kwargs)
-            self.log.debug(
-                "POST %s, headers: %s, body: %s",
-                self.url,
-                req.http_headers,
-                req.http_body,
-            )
-            # XXX It's not entirely clear that `requests.Session` is thread-safe.
-            res = self.http_session.post(
-                self.url,
-                data=req.http_body,
-                headers=req.http_headers,
-                timeout=self.timeout,
-            )
-            res = core.Response.from_http(res.status_code, res.content, res.headers)
+            self.log.debug("POST %s: %r", url, req)
+            with cancellation:
+                res = self._post(req, url, timeout)
             self.log.debug("Response: %r", res)
-            self.timer.stop()
-            self.context.update_metadata(res.metadata)
         except requests.Timeout as exc:
             self.log.debug("Got timeout error: %s", exc)
-            res = errors.Timeout(self.url)
+            res = errors.Timeout(url)
+        except Exception as exc:
+            if cancellation.cancelled:
+                self.log.debug("%r: Request to %s cancelled", self, url)
+            else:
+                self.log.info(
+                    "%r failed: %s", self, exc, exc_info=True, stack_info=True,
+                )
+            res = exc
+        timer.stop()
+        load.finished(url, timer.elapsed)
+        if not cancellation.cancelled:
+            # The worker did nothing wrong.
+            circuit.breakers().record(url, res)
+        return res
+
+    def _post(self, req, url, timeout):
+        mt = media_types()
+        media_type = mt.request_type(url)
+        try:
+            data = req.encode(media_type)
+        except (TypeError, ValueError, OverflowError) as exc:
+            if media_type == json.JSON:
+                raise
+            self.log.debug("Cannot encode request as %s: %s", media_type, exc)
+            media_type = json.JSON
+            data = req.encode(media_type)
+        headers = http_headers(req, media_type)
+        headers["accept"] = mt.accept
+        headers["content-type"] = media_type
+        res = self.transport.post(
+            socket_url(url),
+            data=data,
+            headers=headers,
+            timeout=timeout,
+        )
+        if res.status_code == 415 and media_type != json.JSON:
+            self.log.info("%s does not accept %s, using JSON", url, media_type)
+            mt.rejected(url)
+            return self._post(req, url, timeout)
+
+        media_type = json.media_type(res.headers.get("content-type"))
+        mt.replied(url, media_type)
+        return core.Response.from_http(
+            res.status_code, res.content, res.headers, media_type
+        )
+
+    def _local_attempt(self, timeout):
+        """Calls the service instance hosted by this process directly.
+
+        Arguments and results are still encoded and decoded as they would be
+        if sent over HTTP, so that services see no difference. Calls not
+        done within `timeout` seconds fail with `servicelib.errors.Timeout`,
+        as they do over HTTP, and are left running.
+
+        """
+        if timeout is None:
+            return self._local_call()
+        future = local_executor().submit(self._local_call)
+        try:
+            return future.result(timeout=timeout)
+        except futures.TimeoutError:
+            self.log.debug("%r: Timed out after %s s", self, timeout)
+            return errors.Timeout(self.url)
+
+    def _local_call(self):
+        try:
+            # Plain JSON, so that arguments and results round trip as they do
+            # with workers which only speak JSON.
+            media_types = [json.JSON]
+            media_type = json.JSON
+            req = core.Request(*self.args, **self.kwargs)
+            req = core.Request.from_http(
+                req.encode(media_type), http_headers(req, media_type), media_type
+            )
+            self.log.debug("Calling local instance of %s: %r", self.service, req)
+            res = self.instance._execute(req, media_types)
+            media_type, body = res.encode(media_types)
+            res = core.Response.from_http(
+                res.http_status, body, http_headers(res, media_type), media_type
+            )
+            self.log.debug("Response: %r", res)
         except Exception as exc:
             self.log.info(
                 "%r failed: %s", self, exc, exc_info=True, stack_info=True,
             )
             res = exc
+        return res
+
+    def _done(self, res):
+        """Records `res` as the outcome of this call.
+
+        `res` is either a `servicelib.core.Response` or an exception.
+
+        """
+        if isinstance(res, core.Response):
+            res.metadata.when_loaded(self._annotate_metadata)
+            self.call_metadata = res.metadata
+            self.context.update_metadata(res.metadata)
 
         res.metadata = self.context.metadata
         self._response = res
 
-    def wait(self, timeout=None):
-        if self._response is None:
-            self._thread.join(timeout=timeout)
-            if timeout is not None:
-                if self._thread.is_alive():
-                    raise errors.Timeout(self.url)
+    def _annotate_metadata(self, metadata):
+        metadata.add_timer("queue", self.queue_timer)
+        if len(self.attempt_timers) > 1:
+            metadata.annotate("attempts", len(self.attempt_timers))
+            for i, t in enumerate(self.attempt_timers):
+                metadata.add_timer("attempt-{}".format(i + 1), t)
+        if self.hedge_winner is not None:
+            metadata.annotate("hedge-winner", self.hedge_winner)
+
+    def _wait(self, timeout=None):
+        try:
+            self._future.result(timeout=timeout)
+        except futures.TimeoutError:
+            raise errors.Timeout(self.url)
 
         if isinstance(self._response, Exception):
             raise self._response
 
-        result = self._response.value
+        if self._response.http_status != 200:
+            raise self._response.value
+
+        return self._response
+
+    def wait(self, timeout=None):
+        res = self._wait(timeout)
+
+        result = res.value
         if isinstance(result, Exception):
             raise result
 
-        return result, self._response.metadata
+        return result, res.metadata
 
     @property
     def result(self):
         r, _ = self.wait()
         return r
 
+    @property
+    def encoded_result(self):
+        """The result of this call, as a `servicelib.core.Encoded`.
+
+        It is not decoded, so that services forwarding it may return it as
+        it is.
+
+        """
+        return self._wait().encoded_value()
+
     @property
     def metadata(self):
         _, m = self.wait()
@@ -154,9 +823,105 @@ class Result(object):
         return self.__class__._default_timeout
 
 
+class BatchResult(Result):
+
+    """Result of a call sent as part of a batch by `Broker.execute_batch()`."""
+
+    def __init__(self, service, args, kwargs, context):
+        super(BatchResult, self).__init__(
+            None, service, args, kwargs, context, None, retry.RetryPolicy()
+        )
+
+    def as_dict(self):
+        ret = core.Request(*self.args, **self.kwargs).as_dict()
+        ret["service"] = self.service
+        return ret
+
+    def __repr__(self):
+        return "BatchResult(%r, %r)" % (self.url, self.args,)
+
+
+def batch_url(service_url):
+    """Returns the URL of the batch endpoint of the worker at `service_url`."""
+    base, sep, _ = service_url.rpartition("/services/")
+    if not sep:
+        raise ValueError("Not a service URL: {}".format(service_url))
+    return "{}/batch".format(base)
+
+
+class Batch(object):
+
+    """Sends several calls to a worker in a single HTTP request."""
+
+    log = logutils.get_logger(__name__)
+
+    def __init__(self, transport, url, results, timeout, executor):
+        self.transport = transport
+        self.url = url
+        self.results = results
+        self.timeout = timeout
+        self.queue_timer = Timer()
+        self.queue_timer.start()
+        future = executor.submit(self._runner)
+        for r in results:
+            r.queue_timer = self.queue_timer
+            r._future = future
+
+    def _runner(self):
+        self.queue_timer.stop()
+        for r in self.results:
+            r.timer.start()
+
+        try:
+            body = json.dumps(self.results)
+            self.log.debug("POST %s, body: %s", self.url, body)
+            res = self.transport.post(
+                socket_url(self.url),
+                data=body,
+                headers={"content-type": "application/json"},
+                timeout=self.timeout,
+            )
+            try:
+                body = json.loads(res.content)
+            except Exception:
+                raise Exception("{}: {}".format(res.status_code, res.content))
+            if res.status_code != 200:
+                raise errors.Serializable.from_dict(body)
+            if not isinstance(body, list) or len(body) != len(self.results):
+                raise errors.CommError(
+                    "{}: Expected {} responses".format(self.url, len(self.results))
+                )
+            responses = [core.Response.from_dict(d) for d in body]
+            for r in self.results:
+                r.timer.stop()
+        except requests.Timeout as exc:
+            self.log.debug("Got timeout error: %s", exc)
+            responses = [errors.Timeout(self.url) for _ in self.results]
+        except Exception as exc:
+            self.log.info(
+                "%r failed: %s", self, exc, exc_info=True, stack_info=True,
+            )
+            responses = [exc for _ in self.results]
+
+        for url in set(r.url for r in self.results):
+            circuit.breakers().record(url, responses[0])
+        for r, res in zip(self.results, responses):
+            r._done(res)
+
+    def __repr__(self):
+        return "Batch(%r, %r)" % (self.url, len(self.results))
+
+
 class Broker(object):
+
+    log = logutils.get_logger(__name__)
+
     def __init__(self, thing=None, **kwargs):
-        self.http_session = requests.Session()
+        self._transport = None
+        self._executor = None
+        self._retry_policy = None
+        self._hedge_delay = None
+        self._idempotent_services = None
         if isinstance(thing, Context):
             self._context = thing
             self._kwargs = None
@@ -164,6 +929,77 @@ class Broker(object):
             self._context = None
             self._kwargs = kwargs
 
+    @property
+    def transport(self):
+        if self._transport is not None:
+            return self._transport
+        return transport()
+
+    @transport.setter
+    def transport(self, value):
+        self._transport = value
+
+    @property
+    def retry_policy(self):
+        """Retry policy for calls which do not specify one.
+
+        Defaults to `servicelib.retry.default_policy()`.
+
+        """
+        if self._retry_policy is not None:
+            return self._retry_policy
+        return retry.default_policy()
+
+    @retry_policy.setter
+    def retry_policy(self, value):
+        self._retry_policy = value
+
+    @property
+    def hedge_delay(self):
+        """Hedging delay for calls which do not specify one.
+
+        Either a number of seconds, or ``"p<NN>"`` for the ``NN``-th
+        percentile of the latencies of each service. Defaults to
+        ``client.hedge_delay``. When ``None``, calls are not hedged.
+
+        """
+        if self._hedge_delay is not None:
+            return self._hedge_delay
+        return config.get("client.hedge_delay", default=None)
+
+    @hedge_delay.setter
+    def hedge_delay(self, value):
+        self._hedge_delay = value
+
+    @property
+    def idempotent_services(self):
+        """Names of the services whose calls may be hedged.
+
+        Defaults to ``client.idempotent_services``.
+
+        """
+        if self._idempotent_services is not None:
+            return self._idempotent_services
+        return config.get("client.idempotent_services", default=[])
+
+    @idempotent_services.setter
+    def idempotent_services(self, value):
+        self._idempotent_services = value
+
+    @property
+    def http_session(self):
+        return self.transport.session
+
+    @property
+    def executor(self):
+        if self._executor is not None:
+            return self._executor
+        return executor()
+
+    @executor.setter
+    def executor(self, value):
+        self._executor = value
+
     @property
     def context(self):
         if self._context is not None:
@@ -172,7 +1008,7 @@ class Broker(object):
         name, _ = os.path.splitext(os.path.basename(sys.argv[0]))
         return ClientContext(name, **self._kwargs)
 
-    def execute(self, service_name, *args, **kwargs):
+    def _call_context(self, kwargs):
         try:
             context = kwargs["context"]
             if context is None:
@@ -180,12 +1016,218 @@ class Broker(object):
             del kwargs["context"]
         except KeyError:
             context = self.context
+        return context
+
+    def execute(self, service_name, *args, **kwargs):
+        """Calls service `service_name` with arguments `args`.
+
+        Keyword arguments ``timeout`` (per HTTP request) and ``deadline``
+        (for all attempts) are in seconds. Keyword argument ``retry`` is
+        either a `servicelib.retry.RetryPolicy`, or the maximum number of
+        attempts, overriding that of `retry_policy`.
+
+        Calls to services in `idempotent_services` are hedged. Keyword
+        argument ``hedge`` overrides `hedge_delay` for them, and disables
+        hedging when false.
+
+        Keyword arguments ``context``, ``timeout``, ``deadline``, ``retry``
+        and ``hedge`` are therefore reserved, and never sent to the service.
+        All other keyword arguments are sent as request metadata.
+
+        """
+        context = self._call_context(kwargs)
+        retry_policy = kwargs.pop("retry", None)
+        if retry_policy is None:
+            retry_policy = self.retry_policy
+        elif not isinstance(retry_policy, retry.RetryPolicy):
+            retry_policy = self.retry_policy.with_attempts(retry_policy)
+        hedge = kwargs.pop("hedge", None)
+        if service_name not in self.idempotent_services or hedge is False:
+            hedge = None
+        elif hedge is None:
+            hedge = self.hedge_delay
+        if hedge is not None:
+            hedging.parse_delay(hedge)
         context.pre_execute_hook(self, service_name, args, kwargs)
 
         check_args(args)
         check_args(kwargs)
 
-        return Result(self.http_session, service_name, args, kwargs, context)
+        return Result(
+            self.transport,
+            service_name,
+            args,
+            kwargs,
+            context,
+            self.executor,
+            retry_policy=retry_policy,
+            hedge=hedge,
+        )
+
+    def map(
+        self,
+        service_name,
+        iterable,
+        concurrency=None,
+        ordered=False,
+        deadline=None,
+        **kwargs
+    ):
+        """Calls service `service_name` once for each item in `iterable`.
+
+        Items which are tuples are the positional arguments for each call.
+        Any other item is passed as the only argument. Keyword arguments are
+        passed to every call.
+
+        Yields ``(args, result, metadata)`` triples, in completion order
+        unless `ordered` is true. ``result`` is the exception raised by the
+        call, if it failed, and ``metadata`` is the metadata of that call
+        alone (``None`` if the service could not be reached). Failing to
+        even start a call, for instance because the service cannot be looked
+        up, is reported the same way.
+
+        At most `concurrency` calls (``client.max_workers`` by default) are
+        in flight at any given time. Items are consumed from `iterable` only
+        when there is room for them.
+
+        If `deadline` (in seconds) is given, iteration stops when it expires,
+        leaving out the calls which had not completed by then. If `ordered`
+        is true, calls completed by then but queued behind some pending call
+        are yielded last, still in order.
+
+        """
+        if concurrency is None:
+            concurrency = get_max_workers()
+        if concurrency < 1:
+            raise ValueError("Invalid concurrency: {}".format(concurrency))
+        if deadline is not None:
+            deadline = time.time() + check_timeout(deadline)
+
+        items = iter(iterable)
+        in_flight = {}
+        order = collections.deque()
+
+        while True:
+            while items is not None and len(in_flight) < concurrency:
+                try:
+                    args = next(items)
+                except StopIteration:
+                    items = None
+                    break
+                if not isinstance(args, tuple):
+                    args = (args,)
+
+                call_kwargs = dict(kwargs)
+                if deadline is not None:
+                    call_kwargs["deadline"] = max(deadline - time.time(), 0.0)
+
+                try:
+                    res = self.execute(service_name, *args, **call_kwargs)
+                    future = res._future
+                except Exception as exc:
+                    # Such as a failed lookup: yielded like failed calls.
+                    self.log.info("map(%s): %r failed: %s", service_name, args, exc)
+                    res = exc
+                    future = futures.Future()
+                    future.set_result(None)
+                in_flight[future] = (args, res)
+                if ordered:
+                    order.append(future)
+
+            if not in_flight:
+                return
+
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0.0)
+
+            if ordered:
+                done, _ = futures.wait([order[0]], timeout=timeout)
+                if done:
+                    done = []
+                    while order and order[0].done():
+                        done.append(order.popleft())
+            else:
+                done, _ = futures.wait(
+                    list(in_flight),
+                    timeout=timeout,
+                    return_when=futures.FIRST_COMPLETED,
+                )
+
+            if not done:
+                if ordered:
+                    done = [f for f in order if f.done()]
+                    for f in done:
+                        yield self._map_item(*in_flight.pop(f))
+                self.log.info(
+                    "map(%s): Deadline expired, %s calls pending",
+                    service_name,
+                    len(in_flight),
+                )
+                return
+
+            for f in done:
+                yield self._map_item(*in_flight.pop(f))
+
+    @staticmethod
+    def _map_item(args, res):
+        if isinstance(res, Exception):
+            return args, res, None
+        try:
+            value, _ = res.wait()
+        except Exception as exc:
+            value = exc
+        return args, value, res.call_metadata
+
+    def execute_batch(self, calls, **kwargs):
+        """Calls several services, sending one HTTP request per worker.
+
+        `calls` is an iterable of ``(service_name, args)`` or ``(service_name,
+        args, kwargs)`` tuples. Calls to services hosted by the same worker are
+        sent together to its ``/batch`` endpoint.
+
+        Keyword arguments ``context`` and ``timeout`` apply to the whole batch.
+
+        Returns a list of `BatchResult` instances, one per call, in the same
+        order as `calls`.
+
+        """
+        context = self._call_context(kwargs)
+        timeout = check_timeout(kwargs.pop("timeout", get_default_timeout()))
+
+        ret = []
+        batches = {}
+        for call in calls:
+            service_name, args = call[0], tuple(call[1])
+            call_kwargs = dict(call[2]) if len(call) > 2 else {}
+            call_kwargs.pop("timeout", None)
+            context.pre_execute_hook(self, service_name, args, call_kwargs)
+
+            check_args(args)
+            check_args(call_kwargs)
+
+            res = BatchResult(service_name, args, call_kwargs, context)
+            if res.instance is not None:
+                res.timeout = timeout
+                res._submit(self.executor)
+            else:
+                batches.setdefault(batch_url(res.url), []).append(res)
+            ret.append(res)
+
+        for url, results in batches.items():
+            Batch(self.transport, url, results, timeout, self.executor)
+
+        return ret
+
+    def pool_stats(self):
+        """Returns connection pool counters, as per `HttpTransport.stats()`."""
+        return self.transport.stats()
 
     def close(self):
-        self.http_session.close()
+        """Closes the connections of this broker's own transport, if any.
+
+        The process-wide transport returned by `transport()` is left open.
+
+        """
+        if self._transport is not None:
+            self._transport.close()
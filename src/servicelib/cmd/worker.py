@@ -26,12 +26,14 @@ def main():
 
     cmdline_config = cmdline.parse_args(
         "worker.autoreload",
+        "worker.batch_threads",
         "worker.hostname",
         "worker.load_workers",
         "worker.num_processes",
         "worker.num_threads",
         "worker.port",
         "worker.services_dir",
+        "worker.unix_socket",
     )
     for k, v in cmdline_config.items():
         if isinstance(v, list):
@@ -64,6 +66,11 @@ def main():
         cmd.extend(["--static-map", "/docs={}".format(swagger_ui)])
         cmd.extend(["--static-index", "index.html"])
 
+    unix_socket = config.get("worker.unix_socket", default=None)
+    if unix_socket is not None:
+        # Any local user may connect over TCP, so let them use the socket too.
+        cmd.extend(["--http-socket", unix_socket, "--chmod-socket=666"])
+
     static_assets = config.get("worker.static_map", default=None)
     if static_assets is not None:
         cmd.extend(["--static-map", static_assets])
@@ -17,9 +17,11 @@ __all__ = [
     "Path",
     "env_var",
     "open",
+    "quote",
     "raise_from",
     "scandir",
     "string_types",
+    "unquote",
     "urlparse",
 ]
 
@@ -28,6 +30,8 @@ PY3 = six.PY3
 raise_from = six.raise_from
 string_types = six.string_types
 urlparse = six.moves.urllib_parse.urlparse
+quote = six.moves.urllib_parse.quote
+unquote = six.moves.urllib_parse.unquote
 
 _builtin_open = open
 
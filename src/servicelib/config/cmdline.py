@@ -35,6 +35,12 @@ SUPPORTED_ENTRIES = {
         "metavar": "N",
         "help": "check for changes every N seconds",
     },
+    "worker.batch_threads": {
+        "type": int,
+        "metavar": "N",
+        "help": "number of threads per process running batch items "
+        "(default: as many as worker threads)",
+    },
     "worker.hostname": {
         "type": str,
         "metavar": "HOST",
@@ -65,6 +71,11 @@ SUPPORTED_ENTRIES = {
         "metavar": "PATH",
         "help": "path to service implementations",
     },
+    "worker.unix_socket": {
+        "type": str,
+        "metavar": "PATH",
+        "help": "path of a Unix socket to listen on for HTTP connections as well",
+    },
 }
 
 
@@ -16,10 +16,11 @@ import uuid
 
 from servicelib import errors, logutils
 from servicelib import encoding as json
-from servicelib.metadata import Metadata
+from servicelib.metadata import LazyMetadata, Metadata
 
 
 __all__ = [
+    "Encoded",
     "Request",
     "Response",
     "call_id",
@@ -84,9 +85,23 @@ class Request(object):
     def http_body(self):
         return json.dumps(self.args)
 
+    def encode(self, media_type=json.JSON):
+        """Returns the HTTP body of this request, encoded in `media_type`.
+
+        Envelopes carry keyword arguments as well, and `http_headers` are
+        not needed then.
+
+        """
+        if json.is_envelope(media_type):
+            return json.encode(self.as_dict(), media_type)
+        return json.encode(self.args, media_type)
+
     @classmethod
-    def from_http(cls, body, headers):
-        args = json.loads(body)
+    def from_http(cls, body, headers, media_type=json.JSON):
+        if json.is_envelope(media_type):
+            return cls.from_dict(json.decode(body, media_type))
+
+        args = json.decode(body, media_type)
         if not isinstance(args, list):
             raise ValueError("List expected")
 
@@ -98,25 +113,86 @@ class Request(object):
 
         return cls(*args, **kwargs)
 
+    def as_dict(self):
+        return {"args": list(self.args), "kwargs": self.kwargs}
+
+    @classmethod
+    def from_dict(cls, d):
+        args = d.get("args", [])
+        if not isinstance(args, list):
+            raise ValueError("List expected")
+
+        kwargs = d.get("kwargs", {})
+        if not isinstance(kwargs, dict):
+            raise ValueError("Object expected")
+
+        return cls(*args, **kwargs)
+
+    def __repr__(self):
+        return "Request(args={!r}, kwargs={!r})".format(self.args, self.kwargs)
+
     def __eq__(self, other):
         if isinstance(other, Request):
             return self.args == other.args and self.kwargs == other.kwargs
         return False  # pragma: no cover
 
 
+class Encoded(object):
+
+    """A value already encoded in `media_type`, as the bytes `data`.
+
+    Services may return one, such as the `servicelib.client.Result.encoded_result`
+    of a call they forward, so that it is sent as it is.
+
+    """
+
+    def __init__(self, data, media_type=json.JSON):
+        self.data = data
+        self.media_type = media_type
+
+    def decode(self):
+        return json.decode(self.data, self.media_type)
+
+    def __repr__(self):
+        return "Encoded(<{} bytes of {}>)".format(len(self.data), self.media_type)
+
+
 class Response(object):
 
     log = logutils.get_logger(__name__)
 
-    def __init__(self, value, metadata, encoded=None):
-        self.value = value
+    def __init__(self, value, metadata, encoded=None, media_type=json.JSON):
+        self._encoded = {}
+        if isinstance(value, Encoded):
+            self._encoded[value.media_type] = value.data
+        self._value = value
         self.metadata = metadata
-        self._encoded_body = encoded
+        if encoded is not None:
+            self._encoded[media_type] = encoded
+
+    @property
+    def value(self):
+        # Values received are decoded on first use.
+        if isinstance(self._value, Encoded):
+            self._value = self._value.decode()
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._encoded = {}
+
+    @property
+    def decoded(self):
+        return not isinstance(self._value, Encoded)
 
     @property
     def http_status(self):
-        if hasattr(self.value, "http_response_code"):
-            return self.value.http_response_code
+        # Only successful responses are left undecoded.
+        if not self.decoded:
+            return 200
+        if hasattr(self._value, "http_response_code"):
+            return self._value.http_response_code
         return 200
 
     @property
@@ -128,29 +204,125 @@ class Response(object):
 
     @property
     def http_body(self):
-        if self._encoded_body is None:
-            self._encoded_body = json.dumps(self.value).encode("utf-8")
-        return self._encoded_body
+        return self.encode([json.JSON])[1]
+
+    def encode(self, media_types):
+        """Returns ``(media_type, body)``, the HTTP body of this response
+        encoded in the first of `media_types` able to represent its value.
+
+        Envelopes carry metadata as well, and `http_headers` are not needed
+        then.
+
+        Values not decoded yet are preferably sent in the media type they
+        were received in, as they are.
+
+        """
+        if not self.decoded:
+            media_types = sorted(
+                media_types, key=lambda t: json.unwrap(t) not in self._encoded
+            )
+        for i, media_type in enumerate(media_types):
+            ret = self._encoded.get(media_type)
+            if ret is not None:
+                return media_type, ret
+            try:
+                if json.is_envelope(media_type):
+                    ret = self._envelope(media_type)
+                else:
+                    ret = json.encode(self.value, media_type)
+                self._encoded[media_type] = ret
+            except Exception as exc:
+                if i == len(media_types) - 1:
+                    raise
+                self.log.debug("Cannot encode response as %s: %s", media_type, exc)
+            else:
+                return media_type, ret
+
+    def encoded_value(self):
+        """Returns the value of this response as an `Encoded`, reusing the
+        bytes it was received as if any.
+
+        """
+        media_types = [t for t in self._encoded if not json.is_envelope(t)]
+        media_type, data = self.encode(media_types + [json.JSON])
+        return Encoded(data, media_type)
+
+    def _envelope(self, media_type):
+        _, value = self.encode([json.unwrap(media_type)])
+        return json.encode_map(
+            [
+                ("status", json.encode(self.http_status, media_type)),
+                ("metadata", self.metadata.encode(media_type)),
+                ("value", value),
+            ],
+            media_type,
+        )
 
     @classmethod
-    def from_http(cls, status, body, headers):
+    def from_http(cls, status, body, headers, media_type=json.JSON):
+        """Returns the response received as `body`, with HTTP `status` and
+        `headers`.
+
+        The value and metadata of successful responses are decoded when first
+        accessed, so that callers not looking at them, or forwarding them as
+        they are, do not pay for it.
+
+        """
         cls.log.debug("from_http(status=%s, body=<%s>): Entering", status, body)
-        body_decoded = json.loads(body)
+        if json.is_envelope(media_type):
+            return cls._from_envelope(body, media_type)
+
         if status == 200:
-            value = body_decoded
+            value = Encoded(body, json.unwrap(media_type))
         else:
-            value = errors.Serializable.from_dict(body_decoded)
-        metadata = Metadata.from_http_headers(
-            {
-                k[len("x-servicelib-") :]: v
-                for (k, v) in headers.items()
-                if k.startswith("x-servicelib-")
-            }
-        )
-        return cls(value, metadata, body)
+            value = errors.Serializable.from_dict(json.decode(body, media_type))
+        metadata_headers = {
+            k[len("x-servicelib-") :]: v
+            for (k, v) in headers.items()
+            if k.startswith("x-servicelib-")
+        }
+        metadata = LazyMetadata(lambda: Metadata.from_http_headers(metadata_headers))
+        return cls(value, metadata, body, media_type)
+
+    @classmethod
+    def _from_envelope(cls, body, media_type):
+        plain = json.unwrap(media_type)
+        parts = json.split_map(body, media_type)
+        if parts is None:
+            # No way to tell where the value is but decoding the whole body.
+            d = json.decode(body, media_type)
+            status, value = d["status"], d["value"]
+            metadata = LazyMetadata(lambda: Metadata.from_dict(d["metadata"]))
+        else:
+            status = json.decode(parts["status"], plain)
+            value = Encoded(parts["value"], plain)
+            metadata = LazyMetadata(
+                lambda: Metadata.from_dict(json.decode(parts["metadata"], plain))
+            )
+
+        if status != 200:
+            if isinstance(value, Encoded):
+                value = value.decode()
+            value = errors.Serializable.from_dict(value)
+        return cls(value, metadata, body, media_type)
+
+    def as_dict(self):
+        return {
+            "status": self.http_status,
+            "value": self.value,
+            "metadata": self.metadata.as_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        if d["status"] == 200:
+            value = d["value"]
+        else:
+            value = errors.Serializable.from_dict(d["value"])
+        return cls(value, Metadata.from_dict(d["metadata"]))
 
     def __repr__(self):
-        return "Response(value={!r}, metadata={!r})".format(self.value, self.metadata)
+        return "Response(value={!r}, metadata={!r})".format(self._value, self.metadata)
 
     def __eq__(self, other):
         if isinstance(other, Response):
@@ -7,19 +7,67 @@
 # granted to it by virtue of its status as an intergovernmental organisation
 # nor does it submit to any jurisdiction.
 
-"""JSON support code."""
+"""JSON support code.
+
+The JSON library doing the actual work is chosen with the
+``encoding.json_backend`` config setting:
+
+``auto`` (the default)
+    The fastest of ``rapidjson`` and ``ujson`` which is installed, or else
+    ``json``.
+
+``orjson``, ``rapidjson``, ``ujson``
+    The corresponding third-party library. ``orjson`` is never picked by
+    ``auto``: making its output the same as the standard library's takes
+    more time than it saves, unless values hold few floats (see
+    ``scripts/bench-encoding``).
+
+``json``
+    The standard library.
+
+Whatever the backend, the output decodes to the same values, with non-ASCII
+characters escaped. Anything a backend cannot handle the way the standard
+library does (integers larger than 64 bits, ``NaN`` when decoding, etc.), and
+calls with extra arguments such as ``sort_keys``, go to the standard library.
+
+Request and response bodies may also be exchanged as msgpack, and wrapped in
+envelopes, when both ends support it (see `media_types()`).
+
+"""
 
 from __future__ import absolute_import, unicode_literals
 
 import json
+import math
+import re
+
+from servicelib import config, logutils
 
 
 __all__ = [
+    "ENVELOPE_JSON",
+    "ENVELOPE_MSGPACK",
+    "JSON",
+    "MSGPACK",
+    "accepted",
+    "backend",
+    "decode",
+    "dumpb",
     "dumps",
+    "encode",
+    "encode_map",
+    "is_envelope",
     "loads",
+    "media_type",
+    "media_types",
+    "split_map",
+    "unwrap",
 ]
 
 
+log = logutils.get_logger(__name__)
+
+
 # See http://tinyurl.com/ykhqrre
 #
 # ``str`` seems to do the job best, at least under Python 2.5:
@@ -30,6 +78,98 @@ __all__ = [
 json.encoder.FLOAT_REPR = str
 
 
+def _default(obj):
+    if hasattr(obj, "as_dict"):
+        return obj.as_dict()
+    raise TypeError(
+        "Object of type {} is not JSON serializable".format(type(obj).__name__)
+    )
+
+
+_NON_ASCII = re.compile("[^\\x00-\\x7f]")
+
+
+def _escape_non_ascii(match):
+    # As `json.encoder.py_encode_basestring_ascii()` does.
+    n = ord(match.group(0))
+    if n < 0x10000:
+        return "\\u{0:04x}".format(n)
+    n -= 0x10000
+    return "\\u{0:04x}\\u{1:04x}".format(
+        0xD800 | ((n >> 10) & 0x3FF), 0xDC00 | (n & 0x3FF)
+    )
+
+
+# `orjson` may format floats differently from `repr()` when they have an
+# exponent, or at least four leading zeros after the decimal point. These
+# also match within strings, which `_repr_floats()` skips.
+_EXPONENT = re.compile(b"e[-0-9]")
+
+_LEADING_ZEROS = b"0.0000"
+
+_ESCAPE = re.compile(b"\\\\.")
+
+_DIGITS = frozenset(b"0123456789")
+
+_NUMBER_CHARS = frozenset(b"0123456789.eE+-")
+
+
+def _odd_floats(data):
+    """Returns the offsets within JSON `data` of what may be floats `orjson`
+    formats differently from `repr()`, in order.
+
+    """
+    ret = [
+        m.start()
+        for m in _EXPONENT.finditer(data)
+        if m.start() > 0 and data[m.start() - 1] in _DIGITS
+    ]
+    i = data.find(_LEADING_ZEROS)
+    if i >= 0:
+        while i >= 0:
+            ret.append(i)
+            i = data.find(_LEADING_ZEROS, i + 1)
+        ret.sort()
+    return ret
+
+
+def _quotes(data, start, end):
+    """Returns the number of quotes delimiting strings in ``data[start:end]``,
+    where neither `start` nor `end` is within an escape sequence.
+
+    """
+    ret = data.count(b'"', start, end)
+    if ret and b"\\" in data:
+        ret -= _ESCAPE.findall(data, start, end).count(b'\\"')
+    return ret
+
+
+def _repr_floats(data):
+    """Returns JSON `data` with floats formatted as `repr()` does."""
+    ret = []
+    last = 0
+    # Offsets are never within an escape sequence, which only ever starts
+    # with a backslash followed by neither a digit nor ``e``.
+    checked = quotes = 0
+    for start in _odd_floats(data):
+        quotes += _quotes(data, checked, start)
+        checked = start
+        if start < last or quotes % 2:
+            continue
+        end = start
+        while start > 0 and data[start - 1] in _NUMBER_CHARS:
+            start -= 1
+        while end < len(data) and data[end] in _NUMBER_CHARS:
+            end += 1
+        ret.append(data[last:start])
+        ret.append(repr(float(data[start:end])).encode("ascii"))
+        last = end
+    if not ret:
+        return data
+    ret.append(data[last:])
+    return b"".join(ret)
+
+
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
         """Adds support for data types which implement ``as_dict``.
@@ -40,14 +180,440 @@ class JSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+class Backend(object):
+
+    """Encodes and decodes JSON with a given library.
+
+    Methods raise `TypeError` or `ValueError` for anything the library does
+    not handle like the standard library does.
+
+    """
+
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def dumpb(self, obj):
+        return self.dumps(obj).encode("utf-8")
+
+    def loads(self, s):
+        raise NotImplementedError
+
+
+class StdlibBackend(Backend):
+
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=JSONEncoder)
+
+    def loads(self, s):
+        return json.loads(s)
+
+
+class OrjsonBackend(Backend):
+
+    """Uses `orjson`, which outputs UTF-8 bytes.
+
+    `orjson` does not escape non-ASCII characters, so we do it on its output.
+    We also reformat floats it writes differently from the standard library
+    (``1e16`` for ``1e+16``, etc.).
+
+    `orjson` encodes ``NaN`` and infinities as ``null``, and encodes UUIDs and
+    enums, which the standard library rejects. Values which do not decode
+    back to themselves are checked for those.
+
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import enum
+        import uuid
+
+        import orjson
+
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+        # Let `_default()` reject dates and dataclasses, as the standard
+        # library does.
+        self._option = (
+            orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+        self._enum = enum.Enum
+        self._uuid = uuid.UUID
+
+    def dumps(self, obj):
+        return self.dumpb(obj).decode("ascii")
+
+    def dumpb(self, obj):
+        ret = self._dumps(obj, default=_default, option=self._option)
+        if self._loads(ret) != obj:
+            # Tuples, keys other than strings, etc., or something to reject.
+            self._check(obj)
+        if _EXPONENT.search(ret) or _LEADING_ZEROS in ret:
+            ret = _repr_floats(ret)
+        if not ret.isascii():
+            # Non-ASCII characters may only appear within strings.
+            ret = _NON_ASCII.sub(_escape_non_ascii, ret.decode("utf-8"))
+            ret = ret.encode("ascii")
+        return ret
+
+    def loads(self, s):
+        return self._loads(s)
+
+    def _check(self, obj):
+        if isinstance(obj, float):
+            if not math.isfinite(obj):
+                raise ValueError("Out of range float values are not JSON compliant")
+        elif isinstance(obj, dict):
+            for k, v in obj.items():
+                self._check_type(k)
+                self._check(v)
+        elif isinstance(obj, (list, tuple)):
+            for v in obj:
+                self._check(v)
+        elif hasattr(obj, "as_dict"):
+            self._check(obj.as_dict())
+        else:
+            self._check_type(obj)
+
+    def _check_type(self, obj):
+        # Enums deriving from `int`, `str`, etc. are fine.
+        if isinstance(obj, self._uuid) or (
+            isinstance(obj, self._enum) and not isinstance(obj, (int, float, str))
+        ):
+            raise TypeError(
+                "Object of type {} is not JSON serializable".format(
+                    type(obj).__name__
+                )
+            )
+
+
+class RapidjsonBackend(Backend):
+
+    name = "rapidjson"
+
+    def __init__(self):
+        import rapidjson
+
+        self._rapidjson = rapidjson
+        self._number_mode = rapidjson.NM_NAN
+
+    def dumps(self, obj):
+        return self._rapidjson.dumps(
+            obj, default=_default, ensure_ascii=True, number_mode=self._number_mode
+        )
+
+    def loads(self, s):
+        return self._rapidjson.loads(s, number_mode=self._number_mode)
+
+
+class UjsonBackend(Backend):
+
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+
+        self._ujson = ujson
+
+    def dumps(self, obj):
+        return self._ujson.dumps(
+            obj, default=_default, ensure_ascii=True, escape_forward_slashes=False
+        )
+
+    def loads(self, s):
+        return self._ujson.loads(s)
+
+
+_INSTANCE_MAP = {
+    "json": StdlibBackend,
+    "orjson": OrjsonBackend,
+    "rapidjson": RapidjsonBackend,
+    "ujson": UjsonBackend,
+}
+
+# Backends tried by ``auto``, fastest first.
+_AUTO_ORDER = ["rapidjson", "ujson", "json"]
+
+
+def _instance(name):
+    try:
+        ret = _INSTANCE_MAP[name]
+    except KeyError:
+        raise Exception("Invalid value for `encoding.json_backend`: {}".format(name))
+    if isinstance(ret, type):
+        _INSTANCE_MAP[name] = ret = ret()
+    return ret
+
+
+_STDLIB = _instance("json")
+
+_BACKEND = None
+
+
+def backend():
+    """Returns the JSON backend of this process."""
+    global _BACKEND
+    if _BACKEND is None:
+        name = config.get("encoding.json_backend", default="auto")
+        if name != "auto":
+            _BACKEND = _instance(name)
+        else:
+            for name in _AUTO_ORDER:
+                try:
+                    _BACKEND = _instance(name)
+                except ImportError:
+                    continue
+                break
+        log.debug("JSON backend: %s", _BACKEND.name)
+    return _BACKEND
+
+
 def dumps(obj, *args, **kwargs):
     """Serialize ``obj`` to a JSON-formatted string.
 
-    Overrides keyword argument ``cls`` with a reference to `JSONEncoder`.
+    Extra arguments are passed to `json.dumps()`, with keyword argument
+    ``cls`` overridden with a reference to `JSONEncoder`.
 
     """
+    if not (args or kwargs):
+        try:
+            return backend().dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            pass
     kwargs["cls"] = JSONEncoder
     return json.dumps(obj, *args, **kwargs)
 
 
-loads = json.loads
+def dumpb(obj):
+    """Serialize ``obj`` to JSON-formatted UTF-8 bytes."""
+    try:
+        return backend().dumpb(obj)
+    except (TypeError, ValueError, OverflowError):
+        return _STDLIB.dumpb(obj)
+
+
+def loads(s, *args, **kwargs):
+    """Deserialize ``s``, a JSON-formatted string or UTF-8 bytes.
+
+    Extra arguments are passed to `json.loads()`.
+
+    """
+    if not (args or kwargs):
+        try:
+            return backend().loads(s)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return json.loads(s, *args, **kwargs)
+
+
+JSON = "application/json"
+
+MSGPACK = "application/msgpack"
+
+# Envelopes carry request arguments and keyword arguments, or response values
+# and metadata, in the body instead of in HTTP headers.
+ENVELOPE_JSON = "application/vnd.servicelib.envelope+json"
+
+ENVELOPE_MSGPACK = "application/vnd.servicelib.envelope+msgpack"
+
+_ENVELOPES = {
+    ENVELOPE_JSON: JSON,
+    ENVELOPE_MSGPACK: MSGPACK,
+}
+
+_MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": MSGPACK,
+}
+
+_MEDIA_TYPES = None
+
+
+def _msgpack():
+    import msgpack
+
+    return msgpack
+
+
+def _packb(obj):
+    """Encodes `obj` as msgpack, raising `TypeError` if it holds anything
+    JSON would not encode the same way (keys other than strings, bytes), so
+    that values decode the same whatever the media type.
+
+    """
+    msgpack = _msgpack()
+    ret = msgpack.packb(obj, default=_default, use_bin_type=True)
+    # Decoding is much faster than walking `obj`.
+    try:
+        msgpack.unpackb(ret, raw=False, max_bin_len=0)
+    except ValueError as exc:
+        raise TypeError(
+            "Cannot encode keys other than strings, or bytes, as msgpack: "
+            "{}".format(exc)
+        )
+    # Empty bytes get through, but are encoded differently without bin types.
+    if b"\xc4\x00" in ret and ret != msgpack.packb(
+        obj, default=_default, use_bin_type=False
+    ):
+        raise TypeError("Cannot encode bytes as msgpack")
+    return ret
+
+
+def media_types():
+    """Returns the media types this process can encode and decode, in order
+    of preference.
+
+    That is JSON, preceded by msgpack if the `msgpack` package is installed,
+    unless ``encoding.msgpack`` is false. Each is preceded by its envelope
+    variant, unless ``encoding.envelope`` is false.
+
+    """
+    global _MEDIA_TYPES
+    if _MEDIA_TYPES is None:
+        ret = [JSON]
+        if config.get("encoding.msgpack", default=True):
+            try:
+                _msgpack()
+            except ImportError:
+                pass
+            else:
+                ret.insert(0, MSGPACK)
+        if config.get("encoding.envelope", default=True):
+            envelopes = {v: k for (k, v) in _ENVELOPES.items()}
+            ret = [envelopes[t] for t in ret] + ret
+        log.debug("Media types: %s", ret)
+        _MEDIA_TYPES = ret
+    return _MEDIA_TYPES
+
+
+def media_type(content_type):
+    """Returns the media type of a ``Content-Type`` header value.
+
+    Requests and responses without one are JSON.
+
+    """
+    if not content_type:
+        return JSON
+    ret = content_type.split(";", 1)[0].strip().lower()
+    return _MEDIA_TYPE_ALIASES.get(ret, ret)
+
+
+def accepted(accept):
+    """Returns the media types we support out of those listed in an
+    ``Accept`` header value, most preferred first, followed by JSON.
+
+    Wildcards are ignored, so that clients get JSON unless they explicitly
+    ask for something else.
+
+    """
+    supported = media_types()
+    quality = {}
+    for item in (accept or "").split(","):
+        params = item.split(";")
+        t = media_type(params[0])
+        if t not in supported:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            k, _, v = param.partition("=")
+            if k.strip() == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            quality[t] = max(q, quality.get(t, 0.0))
+    ret = sorted(quality, key=lambda t: (-quality[t], supported.index(t)))
+    if JSON not in ret:
+        ret.append(JSON)
+    return ret
+
+
+def is_envelope(media_type):
+    return media_type in _ENVELOPES
+
+
+def unwrap(media_type):
+    """Returns the media type of the contents of envelopes of `media_type`,
+    or `media_type` itself if it is not an envelope.
+
+    """
+    return _ENVELOPES.get(media_type, media_type)
+
+
+def encode(obj, media_type=JSON):
+    """Serialize ``obj`` to bytes of the given media type.
+
+    Values JSON would encode differently from msgpack, or not at all (maps
+    with keys other than strings, ``bytes``), cannot be encoded as msgpack.
+
+    """
+    media_type = unwrap(media_type)
+    if media_type == JSON:
+        return dumpb(obj)
+    if media_type == MSGPACK:
+        return _packb(obj)
+    raise ValueError("Unsupported media type: {}".format(media_type))
+
+
+def encode_map(items, media_type=JSON):
+    """Serialize a map to bytes of the given media type, given its
+    ``(key, encoded value)`` items.
+
+    This saves encoding again values which already are.
+
+    """
+    media_type = unwrap(media_type)
+    if media_type == JSON:
+        return b"".join(
+            [b"{"]
+            + [
+                (b"," if i else b"") + dumpb(k) + b":" + v
+                for (i, (k, v)) in enumerate(items)
+            ]
+            + [b"}"]
+        )
+    if media_type == MSGPACK:
+        packer = _msgpack().Packer(use_bin_type=True)
+        ret = [packer.pack_map_header(len(items))]
+        for k, v in items:
+            ret.append(packer.pack(k))
+            ret.append(v)
+        return b"".join(ret)
+    raise ValueError("Unsupported media type: {}".format(media_type))
+
+
+def split_map(data, media_type=JSON):
+    """Returns ``{key: encoded value}``, the items of a map encoded in
+    `data`, bytes of the given media type, without decoding their values.
+
+    Returns None if this cannot be done without decoding the whole map, as
+    with JSON.
+
+    """
+    if unwrap(media_type) != MSGPACK:
+        return None
+    unpacker = _msgpack().Unpacker(raw=False)
+    unpacker.feed(data)
+    ret = {}
+    for _ in range(unpacker.read_map_header()):
+        key = unpacker.unpack()
+        start = unpacker.tell()
+        unpacker.skip()
+        ret[key] = data[start : unpacker.tell()]
+    return ret
+
+
+def decode(data, media_type=JSON):
+    """Deserialize ``data``, bytes of the given media type."""
+    media_type = unwrap(media_type)
+    if media_type == JSON:
+        return loads(data)
+    if media_type == MSGPACK:
+        return _msgpack().unpackb(data, raw=False)
+    raise ValueError("Unsupported media type: {}".format(media_type))
@@ -12,21 +12,112 @@
 from __future__ import absolute_import, unicode_literals
 
 import json
+import os
+import threading
 
 import falcon
 import psutil
 
-from servicelib import config, errors, logutils
-from servicelib.core import Request
+from servicelib import config, encoding, errors, logutils
+from servicelib.client import DaemonThreadPoolExecutor
+from servicelib.core import Request, Response
+from servicelib.metadata import Metadata
 
 
 __all__ = [
+    "BatchResource",
     "HealthResource",
     "StatsResource",
     "WorkerResource",
+    "batch_executor",
+    "batch_threads",
+    "worker_load",
 ]
 
 
+class InFlight(object):
+
+    """Counts the requests being handled by this process."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.count += 1
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.count -= 1
+
+
+_IN_FLIGHT = InFlight()
+
+
+_BATCH_EXECUTOR = None
+_BATCH_EXECUTOR_PID = None
+_BATCH_EXECUTOR_LOCK = threading.Lock()
+
+
+def batch_threads():
+    """Returns the number of threads running the items of a batch request.
+
+    This is ``worker.batch_threads``, which defaults to ``worker.num_threads``,
+    so that services written for a single-threaded worker are not run
+    concurrently unless asked for.
+
+    """
+    return int(
+        config.get(
+            "worker.batch_threads",
+            default=config.get("worker.num_threads", default=1),
+        )
+    )
+
+
+def batch_executor():
+    """Returns the thread pool which runs the items of batch requests.
+
+    The pool has `batch_threads()` threads. It is not the pool of
+    `servicelib.client.executor()`, since services running in it may wait for
+    calls running in that one. Like it, it is created anew after a
+    ``fork()``.
+
+    """
+    global _BATCH_EXECUTOR, _BATCH_EXECUTOR_PID
+
+    with _BATCH_EXECUTOR_LOCK:
+        pid = os.getpid()
+        if _BATCH_EXECUTOR is None or _BATCH_EXECUTOR_PID != pid:
+            _BATCH_EXECUTOR = DaemonThreadPoolExecutor(batch_threads())
+            _BATCH_EXECUTOR_PID = pid
+        return _BATCH_EXECUTOR
+
+
+def listen_queue():
+    """Returns the number of connections waiting to be accepted, if known."""
+    try:
+        import uwsgi
+
+        return uwsgi.listen_queue()
+    except (ImportError, AttributeError):
+        return 0
+
+
+def worker_load():
+    """Returns the load of this worker process, as published to the service
+    registry.
+
+    """
+    return {
+        "busy": _IN_FLIGHT.count,
+        "threads": int(config.get("worker.num_threads", default=1)),
+        "queue": listen_queue(),
+        "cpu": psutil.cpu_percent(),
+    }
+
+
 class HealthResource(object):
     def on_get(self, req, resp):
         resp.status = falcon.HTTP_200
@@ -91,14 +182,15 @@ class WorkerResource(object):
             self.log.error("Unknown service '%s'", service)
             raise falcon.HTTPNotFound()
 
-        if req.content_type and "application/json" not in req.content_type:
+        media_type = encoding.media_type(req.content_type)
+        if media_type not in encoding.media_types():
             self.log.error("Unsupported request content type '%s'", req.content_type)
             raise falcon.HTTPUnsupportedMediaType()
 
         try:
             body = req.bounded_stream.read()
             headers = req.headers
-            svc_req = Request.from_http(body, headers)
+            svc_req = Request.from_http(body, headers, media_type)
         except Exception as exc:
             self.log.error(
                 "Bad request (body: %s, headers: %s): %s", body, headers, exc
@@ -108,8 +200,72 @@ class WorkerResource(object):
             resp.data = json.dumps(exc.as_dict()).encode("utf-8")
             self.log.debug("Response body: %s", resp.data)
         else:
-            svc_resp = svc._execute(svc_req)
+            media_types = encoding.accepted(req.get_header("accept"))
+            with _IN_FLIGHT:
+                svc_resp = svc._execute(svc_req, media_types)
             resp.status = str(svc_resp.http_status)
-            resp.data = svc_resp.http_body
-            for k, v in svc_resp.http_headers.items():
-                resp.append_header(k, v)
+            resp.content_type, resp.data = svc_resp.encode(media_types)
+            if not encoding.is_envelope(resp.content_type):
+                for k, v in svc_resp.http_headers.items():
+                    resp.append_header(k, v)
+
+
+class BatchResource(object):
+
+    """Executes several service calls sent in a single HTTP request.
+
+    The request body is a JSON array of objects with fields ``service``,
+    ``args`` and ``kwargs``. The response body is a JSON array with, for each
+    call, an object with fields ``status``, ``value`` and ``metadata``.
+
+    Calls run concurrently, in `batch_executor()`, if `batch_threads()` is
+    greater than one, and one after the other otherwise.
+
+    """
+
+    log = logutils.get_logger(__name__)
+
+    def __init__(self, service_instances):
+        self.service_instances = service_instances
+
+    def on_post(self, req, resp):
+        if req.content_type and "application/json" not in req.content_type:
+            self.log.error("Unsupported request content type '%s'", req.content_type)
+            raise falcon.HTTPUnsupportedMediaType()
+
+        try:
+            body = req.bounded_stream.read()
+            items = encoding.loads(body)
+            if not isinstance(items, list):
+                raise ValueError("List expected")
+        except Exception as exc:
+            self.log.error("Bad batch request (body: %s): %s", body, exc)
+            exc = errors.BadRequest(str(exc))
+            resp.status = str(exc.http_response_code)
+            resp.data = json.dumps(exc.as_dict()).encode("utf-8")
+        else:
+            resp.status = falcon.HTTP_200
+            if batch_threads() > 1:
+                results = batch_executor().map(self.execute, items)
+            else:
+                results = map(self.execute, items)
+            resp.data = encoding.dumpb(list(results))
+
+    def execute(self, item):
+        try:
+            name = item["service"]
+            svc = self.service_instances[name]
+        except Exception:
+            self.log.error("Unknown service in batch item %s", item)
+            return Response(
+                errors.BadRequest("Unknown service in batch item"), Metadata("batch")
+            )
+
+        try:
+            svc_req = Request.from_dict(item)
+        except Exception as exc:
+            self.log.error("Bad batch item %s: %s", item, exc)
+            return Response(errors.BadRequest(str(exc)), Metadata(name))
+
+        with _IN_FLIGHT:
+            return svc._execute(svc_req)
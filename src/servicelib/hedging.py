@@ -0,0 +1,212 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""Support code for hedged service calls.
+
+A hedged call sends a second request to another worker when the first one has
+not completed after some delay, and keeps whichever response arrives first.
+The other request is then cancelled with a `Cancellation`.
+
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import collections
+import socket
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from servicelib.compat import string_types
+
+
+__all__ = [
+    "CancellableAdapter",
+    "CancellableConnectionMixin",
+    "Cancellation",
+    "Latencies",
+    "hedge_delay",
+    "latencies",
+]
+
+
+DEFAULT_WINDOW_SIZE = 200
+
+MIN_SAMPLES = 20
+
+
+class Latencies(object):
+
+    """Keeps the latencies of the most recent calls to each service."""
+
+    def __init__(self, size=DEFAULT_WINDOW_SIZE):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, service, elapsed):
+        with self._lock:
+            samples = self._samples.get(service)
+            if samples is None:
+                samples = collections.deque(maxlen=self.size)
+                self._samples[service] = samples
+            samples.append(elapsed)
+
+    def percentile(self, service, p):
+        """Returns the `p`-th percentile of the latencies of `service`.
+
+        Returns ``None`` if there are less than `MIN_SAMPLES` latencies to
+        compute it from.
+
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(service, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        i = int(round((len(samples) - 1) * p / 100.0))
+        return samples[i]
+
+
+_LATENCIES = Latencies()
+
+
+def latencies():
+    """Returns the latencies of calls made by this process."""
+    return _LATENCIES
+
+
+def parse_delay(spec):
+    """Parses a hedging delay specification.
+
+    `spec` is either a number of seconds, or a string ``"p<NN>"`` meaning the
+    ``NN``-th percentile of the observed latencies of the service.
+
+    Returns a pair ``(seconds, percentile)``, one of them ``None``.
+
+    """
+    if isinstance(spec, string_types) and spec[:1] in {"p", "P"}:
+        p = float(spec[1:])
+        if not 0 < p < 100:
+            raise ValueError("Invalid hedging delay: {}".format(spec))
+        return None, p
+    try:
+        return float(spec), None
+    except (TypeError, ValueError):
+        raise ValueError("Invalid hedging delay: {}".format(spec))
+
+
+def hedge_delay(service, spec):
+    """Returns the number of seconds to wait before hedging a call to
+    `service`, or ``None`` if the call should not be hedged.
+
+    """
+    seconds, p = parse_delay(spec)
+    if p is not None:
+        return latencies().percentile(service, p)
+    return seconds
+
+
+_CURRENT = threading.local()
+
+
+def _shutdown(conn):
+    sock = getattr(conn, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, socket.error):
+            pass
+
+
+class Cancellation(object):
+
+    """Lets some thread cancel an HTTP request sent by another.
+
+    Requests sent through a `CancellableAdapter` by a thread within a ``with
+    cancellation:`` block are cancelled by ``cancellation.cancel()``, which
+    shuts their connection down. They then fail with a connection error.
+
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        _CURRENT.cancellation = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _CURRENT.cancellation = None
+        with self._lock:
+            self._conn = None
+
+    def attach(self, conn):
+        with self._lock:
+            self._conn = conn
+            cancelled = self.cancelled
+        if cancelled:
+            _shutdown(conn)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            conn = self._conn
+        if conn is not None:
+            _shutdown(conn)
+
+
+class CancellableConnectionMixin(object):
+
+    """Mixin for `urllib3` connections, attaching them to the `Cancellation`
+    of the thread sending requests over them, if any.
+
+    """
+
+    def request(self, *args, **kwargs):
+        cancellation = getattr(_CURRENT, "cancellation", None)
+        if cancellation is not None:
+            # Connect now, so that there is a socket to shut down.
+            if self.sock is None:
+                self.connect()
+            cancellation.attach(self)
+        return super(CancellableConnectionMixin, self).request(*args, **kwargs)
+
+
+class CancellableHTTPConnection(CancellableConnectionMixin, HTTPConnection):
+    pass
+
+
+class CancellableHTTPSConnection(CancellableConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CancellableHTTPConnectionPool(HTTPConnectionPool):
+
+    ConnectionCls = CancellableHTTPConnection
+
+
+class CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+
+    ConnectionCls = CancellableHTTPSConnection
+
+
+class CancellableAdapter(HTTPAdapter):
+
+    """Transport adapter whose requests may be cancelled, see `Cancellation`."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CancellableAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CancellableHTTPConnectionPool,
+            "https": CancellableHTTPSConnectionPool,
+        }
@@ -9,12 +9,13 @@
 
 from __future__ import absolute_import, unicode_literals
 
-import json
 import os
+import random
 import socket
 import time
 
-from servicelib import compat, logutils
+from servicelib import compat, config, logutils
+from servicelib import encoding as json
 from servicelib.timer import Timer
 
 
@@ -23,6 +24,94 @@ __all__ = []
 
 HOSTNAME = socket.getfqdn().split(".")[0]
 
+DEFAULT_MAX_SIZE = 32 * 1024
+
+
+def max_size():
+    """Returns the size in bytes above which the kids of metadata sent over
+    the wire are dropped, or 0 for no limit.
+
+    """
+    return int(config.get("metadata.max_size", default=DEFAULT_MAX_SIZE))
+
+
+DEFAULT_MAX_KIDS = 100
+
+DEFAULT_MAX_DEPTH = 10
+
+
+def max_kids():
+    """Returns the number of kids kept in full by metadata, or 0 for no
+    limit.
+
+    Further kids are summarised, see `Summary`. If ``metadata.sample_kids``
+    is true, the kids kept are a random sample of all of them instead of the
+    first ones.
+
+    """
+    return int(config.get("metadata.max_kids", default=DEFAULT_MAX_KIDS))
+
+
+def max_depth():
+    """Returns the number of levels of kids of metadata sent over the wire,
+    or 0 for no limit.
+
+    Kids below that are summarised, see `Summary`.
+
+    """
+    return int(config.get("metadata.max_depth", default=DEFAULT_MAX_DEPTH))
+
+
+class Summary(object):
+
+    """Summary of the metadata of calls to some service, made by the same
+    caller: their number, and the number, minimum, maximum and sum of
+    elapsed times of each of their timers.
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.timers = {}
+
+    def add(self, metadata):
+        self.count += 1
+        for name, timer in metadata._timers.items():
+            self.add_timer(name, 1, timer.elapsed, timer.elapsed, timer.elapsed)
+
+    def add_timer(self, name, count, min_, max_, sum_):
+        t = self.timers.get(name)
+        if t is None:
+            self.timers[name] = {"count": count, "min": min_, "max": max_, "sum": sum_}
+        else:
+            t["count"] += count
+            t["min"] = min(t["min"], min_)
+            t["max"] = max(t["max"], max_)
+            t["sum"] += sum_
+
+    def update(self, other):
+        self.count += other.count
+        for name, t in other.timers.items():
+            self.add_timer(name, t["count"], t["min"], t["max"], t["sum"])
+
+    def as_dict(self):
+        return {"count": self.count, "timers": self.timers}
+
+    @classmethod
+    def from_dict(cls, d):
+        ret = cls()
+        ret.count = d["count"]
+        ret.timers = d["timers"]
+        return ret
+
+    def __repr__(self):
+        return "Summary(count={!r}, timers={!r})".format(self.count, self.timers)
+
+    def __eq__(self, other):
+        if isinstance(other, Summary):
+            return self.count == other.count and self.timers == other.timers
+        return False
+
 
 class Metadata(object):
 
@@ -33,6 +122,11 @@ class Metadata(object):
         self._timers = {}
         self._extra = {}
         self._kids = []
+        self._summaries = {}
+        # `(max_kids, sample_kids)`, read on first use.
+        self._kids_policy = None
+        # `(max_size, max_depth)`, read on first use.
+        self._wire_limits = None
         self._notes = {}
         self._host = HOSTNAME
         self._start = time.time()
@@ -46,14 +140,55 @@ class Metadata(object):
             self._notes[key] = value
 
     def update_metadata(self, other):
-        if self != other:
+        if other is self:
+            return
+        # Do not compare with metadata not decoded yet, which would decode it.
+        if not (isinstance(other, LazyMetadata) or self != other):
+            return
+
+        if self._kids_policy is None:
+            self._kids_policy = (
+                max_kids(),
+                config.get("metadata.sample_kids", default=False),
+            )
+        limit, sample = self._kids_policy
+        if limit <= 0 or len(self._kids) < limit:
             self._kids.append(other)
+            return
+
+        if sample:
+            # Reservoir sampling: every kid seen so far is kept with the same
+            # probability.
+            seen = len(self._kids) + sum(s.count for s in self._summaries.values())
+            i = random.randrange(seen + 1)
+            if i < limit:
+                other, self._kids[i] = self._kids[i], other
+
+        self._summarise(self._summaries, [other])
+
+    @staticmethod
+    def _summarise(summaries, kids):
+        for kid in kids:
+            summary = summaries.get(kid._name)
+            if summary is None:
+                summaries[kid._name] = summary = Summary()
+            summary.add(kid)
+
+    def when_loaded(self, func):
+        """Calls ``func(self)`` once this metadata is decoded, which it is
+        unless it is a `LazyMetadata`.
+
+        """
+        func(self)
 
     def timer(self, name):
         if name not in self._timers:
             self._timers[name] = Timer()
         return self._timers[name]
 
+    def add_timer(self, name, timer):
+        self._timers[name] = timer
+
     def start(self):
         self._start = time.time()
 
@@ -67,12 +202,18 @@ class Metadata(object):
             "pid": str(self._pid),
             "start": str(self._start),
             "stop": str(self._stop),
-            "kids": json.dumps([k.as_dict() for k in self._kids]),
         }
 
-        ret.update(
-            {"note-{}".format(k): json.dumps(v) for (k, v) in self._notes.items()}
-        )
+        kids, summaries = self._kids_as_dicts(False, self._max_depth())
+        ret["kids"] = json.dumps(kids)
+        if summaries:
+            ret["summaries"] = json.dumps(summaries)
+
+        notes = self._notes
+        if self._too_large(ret["kids"]):
+            ret["kids"] = "[]"
+            notes = self._notes_without_kids()
+        ret.update({"note-{}".format(k): json.dumps(v) for (k, v) in notes.items()})
 
         timers = dict((k, v.as_dict()) for k, v in self._timers.items())
         timers.update(self._extra)
@@ -87,6 +228,10 @@ class Metadata(object):
             k: Timer.from_dict(v) for k, v in json.loads(h["timers"]).items()
         }
         ret._kids = [cls.from_dict(k) for k in json.loads(h["kids"])]
+        ret._summaries = {
+            k: Summary.from_dict(v)
+            for k, v in json.loads(h.get("summaries", "{}")).items()
+        }
         ret._host = h["host"]
         ret._pid = int(h["pid"])
         ret._start = float(h["start"])
@@ -98,13 +243,63 @@ class Metadata(object):
         }
         return ret
 
-    def as_dict(self):
+    def encode(self, media_type):
+        """Returns this metadata encoded in `media_type`, as sent in response
+        envelopes.
+
+        """
+        d = self.as_dict(compact=True)
+        ret = json.encode(d, media_type)
+        if self._too_large(ret):
+            d["kids"] = []
+            d["notes"] = self._notes_without_kids()
+            ret = json.encode(d, media_type)
+        return ret
+
+    def _limits(self):
+        if self._wire_limits is None:
+            self._wire_limits = (max_size(), max_depth())
+        return self._wire_limits
+
+    def _max_depth(self):
+        return self._limits()[1] or None
+
+    def _too_large(self, encoded):
+        limit = self._limits()[0]
+        if limit <= 0 or len(encoded) <= limit:
+            return False
+        self.log.warning(
+            "Dropping the %s kids of metadata of %s (%s bytes, limit is %s)",
+            len(self._kids),
+            self._name,
+            len(encoded),
+            limit,
+        )
+        return True
+
+    def _notes_without_kids(self):
+        ret = dict(self._notes)
+        ret["kids-dropped"] = len(self._kids)
+        return ret
+
+    def as_dict(self, compact=False):
+        """Returns this metadata as a dict.
+
+        Notes are copied at the top level of the dict, unless `compact` is
+        true.
+
+        """
+        return self._as_dict(compact, self._max_depth())
+
+    def _as_dict(self, compact, depth):
         r = {
             "task": self._name,
             "host": self._host,
             "pid": self._pid,
         }
-        r["kids"] = [k.as_dict() for k in self._kids]
+        r["kids"], summaries = self._kids_as_dicts(compact, depth)
+        if summaries:
+            r["summaries"] = summaries
         r["timers"] = dict((k, v.as_dict()) for k, v in self._timers.items())
         r["timers"].update(self._extra)
 
@@ -115,14 +310,38 @@ class Metadata(object):
             r["stop"] = self._stop
 
         r["notes"] = self._notes
-        r.update(self._notes)
+        if not compact:
+            r.update(self._notes)
         return r
 
+    def _kids_as_dicts(self, compact, depth):
+        """Returns the kids and summaries of this metadata as dicts, with
+        kids summarised instead below `depth` levels (None for no limit).
+
+        """
+        kids, summaries = self._kids, self._summaries
+        if depth is not None:
+            if depth <= 0 and kids:
+                summaries = {}
+                for k, v in self._summaries.items():
+                    summaries[k] = Summary()
+                    summaries[k].update(v)
+                self._summarise(summaries, kids)
+                kids = []
+            depth -= 1
+        return (
+            [k._as_dict(compact, depth) for k in kids],
+            {k: v.as_dict() for (k, v) in summaries.items()},
+        )
+
     @classmethod
     def from_dict(cls, d):
         ret = cls(d["task"])
         ret._timers = {k: Timer.from_dict(v) for k, v in d["timers"].items()}
         ret._kids = [cls.from_dict(k) for k in d["kids"]]
+        ret._summaries = {
+            k: Summary.from_dict(v) for k, v in d.get("summaries", {}).items()
+        }
         ret._notes = d["notes"]
         ret._host = d["host"]
         ret._pid = d["pid"]
@@ -138,6 +357,7 @@ class Metadata(object):
             "timers={!r}, "
             "extra={!r}, "
             "kids={!r}, "
+            "summaries={!r}, "
             "notes={!r}, "
             "host={!r}, "
             "start={!r}, "
@@ -148,6 +368,7 @@ class Metadata(object):
             self._timers,
             self._extra,
             self._kids,
+            self._summaries,
             self._notes,
             self._host,
             self._start,
@@ -162,6 +383,7 @@ class Metadata(object):
                 and self._timers == other._timers
                 and self._extra == other._extra
                 and self._kids == other._kids
+                and self._summaries == other._summaries
                 and self._notes == other._notes
                 and self._host == other._host
                 and self._pid == other._pid
@@ -169,3 +391,40 @@ class Metadata(object):
                 and abs(self._stop - other._stop) < 0.01
             )
         return False
+
+
+class LazyMetadata(Metadata):
+
+    """Metadata decoded on first use, by calling `load`.
+
+    `load` returns a `Metadata`, whose attributes become ours, except those
+    set in the meantime.
+
+    """
+
+    def __init__(self, load):
+        self.__dict__["_load"] = load
+        self.__dict__["_when_loaded"] = []
+
+    def __getattr__(self, name):
+        d = self.__dict__
+        load = d.get("_load")
+        if load is None:
+            raise AttributeError(name)
+        for k, v in load().__dict__.items():
+            d.setdefault(k, v)
+        if d.pop("_load", None) is not None:
+            for func in d.pop("_when_loaded"):
+                func(self)
+        return getattr(self, name)
+
+    def when_loaded(self, func):
+        if "_load" in self.__dict__:
+            self._when_loaded.append(func)
+        else:
+            func(self)
+
+    def __repr__(self):
+        if "_load" in self.__dict__:
+            return "LazyMetadata(<not loaded>)"
+        return super(LazyMetadata, self).__repr__()
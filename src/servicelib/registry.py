@@ -11,16 +11,23 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import contextlib
+import errno
+import fcntl
+import json
+import math
+import os
+import random
 import socket
+import tempfile
 import threading
-
-# import time
+import time
 
 import redis
+import yaml
 
-from servicelib import config, logutils
-
-# from servicelib.compat import urlparse
+from servicelib import balancer, circuit, config, errors, logutils
+from servicelib.compat import string_types, urlparse
 
 
 __all__ = [
@@ -30,18 +37,133 @@ __all__ = [
 
 
 class Registry(object):
+
+    # Workers whose registration lease is not renewed within `lease_ttl`
+    # seconds are considered dead. Leases are not used when 0.
+    lease_ttl = 0
+
     def register(self, services):
         raise NotImplementedError
 
     def unregister(self, services):
         raise NotImplementedError
 
-    # def service_url(self, name, local_only=False):
-    #     raise NotImplementedError
+    def heartbeat(self, services):
+        """Renews the leases of `services`, a list of ``(name, url)`` pairs
+        registered by this process.
+
+        """
+        pass
+
+    def keep_alive(self, services):
+        """Renews the leases of `services` periodically from now on, in a
+        background thread.
+
+        Returns the `Periodic` doing so, if any.
+
+        """
+        if self.lease_ttl > 0:
+            services = list(services)
+            ret = Periodic(
+                lambda: self.heartbeat(services),
+                self.lease_ttl / 3.0,
+                "registry-heartbeat",
+            )
+            ret.start()
+            return ret
+
+    def report_load(self, netloc, sample):
+        """Publishes the load of this worker process, as returned by function
+        `sample`, every ``registry.load_interval`` seconds from now on.
+
+        `netloc` is the ``host:port`` part of the URLs of this worker.
+
+        Returns the `Periodic` doing so, if any.
+
+        """
+        interval = float(config.get("registry.load_interval", default=5))
+        if interval <= 0:
+            return
+
+        def publish():
+            # The uWSGI master process handles no requests.
+            if load_slot() is not None:
+                self.publish_load(netloc, sample(), interval * 3)
+
+        ret = Periodic(publish, interval, "registry-load")
+        ret.start()
+        return ret
+
+    def publish_load(self, netloc, load, ttl):
+        """Records `load`, a dict, as the load of this worker process, for
+        `ttl` seconds.
+
+        """
+        pass
+
+    def worker_load(self, netloc):
+        """Returns the latest load published by the worker at `netloc`, or
+        ``None`` if unknown.
 
-    def service_url(self, name):
+        The load is a dict with keys ``busy`` (number of requests being
+        handled), ``capacity`` (number of requests which may be handled
+        concurrently), ``queue`` (number of requests waiting to be accepted)
+        and ``cpu`` (CPU usage of the host, in percent).
+
+        """
+        return None
+
+    def service_url(self, name, exclude=(), hosts=()):
+        """Returns the URL of some worker hosting service `name`.
+
+        URLs in `exclude` are only returned if there are no others. URLs whose
+        circuit is open (see `servicelib.circuit`) are never returned. URLs of
+        workers running on one of `hosts` are returned first, if any. The
+        choice among the remaining ones is up to the balancer configured in
+        ``registry.balancer`` (see `servicelib.balancer`), weighted in favour
+        of workers running on this host by ``registry.local_weight``.
+
+        """
+        urls = self.service_urls(name)
+        if not urls:
+            raise Exception("No URL for service {}".format(name))
+        b = balancer.instance()
+        local_weight = float(config.get("registry.local_weight", default=1))
+        preferred = prefer_local(
+            b.order([u for u in urls if u not in exclude]), local_weight
+        )
+        others = prefer_local(b.order([u for u in urls if u in exclude]), local_weight)
+        if hosts:
+            preferred = prefer_hosts(preferred, hosts)
+        breakers = circuit.breakers()
+        for url in preferred + others:
+            if breakers.allow(url):
+                return url
+        raise errors.CommError(
+            "No available URL for service {} (all circuits open)".format(name)
+        )
+
+    def service_urls(self, name):
+        """Returns the URLs of all workers hosting service `name`."""
         raise NotImplementedError
 
+    def register_socket(self, netloc, path):
+        """Advertises that the worker at `netloc` (``host:port``) accepts
+        HTTP connections on the Unix socket at `path` as well.
+
+        """
+        pass
+
+    def unregister_socket(self, netloc):
+        pass
+
+    def socket_path(self, netloc):
+        """Returns the path of the Unix socket of the worker at `netloc`, or
+        ``None`` if it has none.
+
+        """
+        return None
+
 
 class NoOpRegistry(Registry):
     def register(self, services):
@@ -51,6 +173,277 @@ class NoOpRegistry(Registry):
         pass
 
 
+class MemoryRegistry(Registry):
+
+    """Keeps service URLs in memory.
+
+    Only services registered by this process may be called, which makes it
+    useful for tests and single-process programs.
+
+    """
+
+    def __init__(self):
+        super(MemoryRegistry, self).__init__()
+        self._urls = {}
+        self._sockets = {}
+        self._lock = threading.RLock()
+
+    def register(self, services):
+        with self._lock:
+            for (name, url) in services:
+                self._urls.setdefault(name, set()).add(url)
+
+    def unregister(self, services):
+        with self._lock:
+            for (name, url) in services:
+                urls = self._urls.get(name, set())
+                urls.discard(url)
+                if not urls:
+                    self._urls.pop(name, None)
+
+    def service_urls(self, name):
+        with self._lock:
+            return sorted(self._urls.get(name, ()))
+
+    def services_by_name(self):
+        with self._lock:
+            return {k: set(v) for (k, v) in self._urls.items()}
+
+    def register_socket(self, netloc, path):
+        with self._lock:
+            self._sockets[netloc] = path
+
+    def unregister_socket(self, netloc):
+        with self._lock:
+            self._sockets.pop(netloc, None)
+
+    def socket_path(self, netloc):
+        with self._lock:
+            return self._sockets.get(netloc)
+
+
+class FileRegistry(MemoryRegistry):
+
+    """Reads service URLs from a YAML or JSON file, mapping service names to
+    lists of URLs.
+
+    The file, set with ``registry.path``, is read again whenever it changes.
+    Workers registering or unregistering update it in place, holding an
+    exclusive lock on ``<path>.lock``. It is written as JSON unless its name
+    ends in ``.yaml`` or ``.yml``. Reserved key ``_sockets`` maps worker
+    ``host:port`` pairs to Unix socket paths.
+
+    """
+
+    # Do not look for changes more often than this, in seconds.
+    check_interval = 1.0
+
+    log = logutils.get_logger(__name__)
+
+    def __init__(self, path=None):
+        super(FileRegistry, self).__init__()
+        if path is None:
+            path = config.get("registry.path")
+        self.path = path
+        self._mtime = None
+        self._checked_at = 0
+
+    def register(self, services):
+        with self._update() as (urls, _):
+            for (name, url) in services:
+                self.log.info("Registering service %s at %s", name, url)
+                urls.setdefault(name, set()).add(url)
+
+    def unregister(self, services):
+        with self._update() as (urls, _):
+            for (name, url) in services:
+                self.log.info("Unregistering service %s at %s", name, url)
+                urls.get(name, set()).discard(url)
+
+    def register_socket(self, netloc, path):
+        with self._update() as (_, sockets):
+            sockets[netloc] = path
+
+    def unregister_socket(self, netloc):
+        with self._update() as (_, sockets):
+            sockets.pop(netloc, None)
+
+    def socket_path(self, netloc):
+        self._reload()
+        return super(FileRegistry, self).socket_path(netloc)
+
+    def service_urls(self, name):
+        self._reload()
+        return super(FileRegistry, self).service_urls(name)
+
+    def services_by_name(self):
+        self._reload()
+        return super(FileRegistry, self).services_by_name()
+
+    def _reload(self, force=False):
+        now = time.time()
+        if not force and now < self._checked_at + self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == self._mtime and not force:
+                return
+            self._urls, self._sockets = self._read()
+            self._mtime = mtime
+            self.log.debug("Read service URLs from %s", self.path)
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = yaml.safe_load(f) or {}
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            data = {}
+        sockets = dict(data.pop("_sockets", None) or {})
+        ret = {}
+        for name, urls in data.items():
+            if isinstance(urls, string_types):
+                urls = [urls]
+            if urls:
+                ret[name] = set(urls)
+        return ret, sockets
+
+    @contextlib.contextmanager
+    def _update(self):
+        with open("{}.lock".format(self.path), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                urls, sockets = self._read()
+                yield urls, sockets
+                data = {k: sorted(v) for (k, v) in urls.items() if v}
+                if sockets:
+                    data["_sockets"] = sockets
+                self._write(data)
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        self._reload(force=True)
+
+    def _write(self, data):
+        dname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_fname = tempfile.mkstemp(dir=dname)
+        try:
+            with os.fdopen(fd, "w") as f:
+                if self.path.endswith((".yaml", ".yml")):
+                    yaml.safe_dump(data, f, default_flow_style=False)
+                else:
+                    json.dump(data, f, indent=2, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_fname, self.path)
+        except Exception:
+            os.unlink(tmp_fname)
+            raise
+
+
+_PERIODICS = []
+
+_FORK_HOOKS_LOCK = threading.Lock()
+
+_FORK_HOOKS_REGISTERED = False
+
+
+def _after_fork():
+    for p in _PERIODICS:
+        p.start()
+
+
+def _register_fork_hooks():
+    """Registers `_after_fork()` to run in forked child processes, once.
+
+    uWSGI forks its workers from C code, which does not run the hooks of
+    `os.register_at_fork()`, but its own.
+
+    """
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork)
+    try:
+        import uwsgidecorators
+    except ImportError:
+        pass
+    else:
+        uwsgidecorators.postfork(_after_fork)
+
+
+class Periodic(object):
+
+    """Calls `func` every `interval` seconds, in a background thread.
+
+    The thread is restarted in child processes (such as uWSGI workers) when
+    forked, until `stop()` is called.
+
+    """
+
+    log = logutils.get_logger(__name__)
+
+    def __init__(self, func, interval, name):
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        global _FORK_HOOKS_REGISTERED
+
+        with self._lock:
+            pid = os.getpid()
+            if self._pid == pid or self._stopped.is_set():
+                return
+            self._pid = pid
+        with _FORK_HOOKS_LOCK:
+            if not _FORK_HOOKS_REGISTERED:
+                _register_fork_hooks()
+                _FORK_HOOKS_REGISTERED = True
+            if self not in _PERIODICS:
+                _PERIODICS.append(self)
+        t = threading.Thread(target=self._run, name=self.name)
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        """Stops calling `func`, here and in processes forked from now on."""
+        self._stopped.set()
+        with _FORK_HOOKS_LOCK:
+            if self in _PERIODICS:
+                _PERIODICS.remove(self)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.func()
+            except Exception as exc:
+                self.log.warning("%s: %s", self.name, exc)
+
+
+def load_slot():
+    """Returns the name under which this process publishes its load.
+
+    uWSGI worker processes use their worker id, which respawned processes
+    inherit, so that dead processes do not linger in their worker's load.
+    Returns ``None`` in the uWSGI master process, which handles no requests.
+
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        return "pid-{}".format(os.getpid())
+    worker_id = uwsgi.worker_id()
+    if worker_id == 0:
+        return None
+    return "worker-{}".format(worker_id)
+
+
 class RedisPool(object):
 
     log = logutils.get_logger(__name__)
@@ -74,24 +467,204 @@ class RedisPool(object):
 
 HOSTNAME = socket.getfqdn()
 
+LOCAL_HOSTNAMES = {
+    HOSTNAME,
+    HOSTNAME.split(".")[0],
+    "localhost",
+    "127.0.0.1",
+    "::1",
+}
+
+_LOCAL_HOSTNAMES = None
+
+
+def local_hostnames():
+    """Returns the names by which workers on this host may be registered."""
+    global _LOCAL_HOSTNAMES
+    if _LOCAL_HOSTNAMES is None:
+        ret = set(LOCAL_HOSTNAMES)
+        worker_hostname = config.get("worker.hostname", default=None)
+        if worker_hostname:
+            ret.add(worker_hostname)
+        _LOCAL_HOSTNAMES = ret
+    return _LOCAL_HOSTNAMES
+
+
+def is_local(url):
+    """Returns true if `url` points to this host."""
+    return urlparse(url).hostname in local_hostnames()
+
+
+def _short_hostname(h):
+    return h.split(".")[0].lower()
+
+
+def prefer_hosts(urls, hosts):
+    """Returns `urls`, with those pointing to one of `hosts` moved first.
+
+    Host names are compared without their domain.
+
+    """
+    hosts = set(_short_hostname(h) for h in hosts)
+    first, rest = [], []
+    for u in urls:
+        h = urlparse(u).hostname
+        if h and _short_hostname(h) in hosts:
+            first.append(u)
+        else:
+            rest.append(u)
+    return first + rest
+
+
+def prefer_local(urls, weight):
+    """Returns `urls`, with those pointing to this host moved first or last.
+
+    Each local URL is `weight` times as likely as each remote one to be
+    moved first: with a weight of 1 there is no preference, and with an
+    infinite weight local URLs always come first. The relative order of
+    local and remote URLs is preserved.
+
+    """
+    if weight == 1:
+        return urls
+    local = [u for u in urls if is_local(u)]
+    remote = [u for u in urls if not is_local(u)]
+    if not local or not remote:
+        return urls
+    if math.isinf(weight):
+        return local + remote
+    w = weight * len(local)
+    if random.random() * (w + len(remote)) < w:
+        return local + remote
+    return remote + local
+
+
+class Cache(object):
+
+    """Caches the values returned by function `fetch`, by key.
+
+    Values older than `ttl` seconds are still returned, but are refreshed in
+    the background. If refreshing a value fails, the last known one is kept.
+
+    """
+
+    log = logutils.get_logger(__name__)
+
+    def __init__(self, ttl, fetch):
+        self.ttl = ttl
+        self._fetch = fetch
+        self._data = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, k):
+        if self._pid != os.getpid():
+            # Refresh threads do not survive forks.
+            self._lock = threading.Lock()
+            self._refreshing = set()
+            self._pid = os.getpid()
+
+        with self._lock:
+            entry = self._data.get(k)
+        if entry is None:
+            v = self._fetch(k)
+            self.put(k, v)
+            return v
+
+        v, expires = entry
+        if time.time() > expires:
+            self._refresh(k)
+        return v
+
+    def put(self, k, v):
+        with self._lock:
+            self._data[k] = (v, time.time() + self.ttl)
+
+    def invalidate(self, k):
+        with self._lock:
+            self._data.pop(k, None)
+
+    def expire_all(self):
+        """Marks all values as stale, so that they are refreshed on next use."""
+        with self._lock:
+            for k, (v, _) in self._data.items():
+                self._data[k] = (v, 0)
+
+    def _refresh(self, k):
+        with self._lock:
+            if k in self._refreshing:
+                return
+            self._refreshing.add(k)
+
+        def run():
+            try:
+                self.put(k, self._fetch(k))
+            except Exception as exc:
+                self.log.warning("Cannot refresh %s, keeping stale value: %s", k, exc)
+                with self._lock:
+                    if k in self._data:
+                        v, _ = self._data[k]
+                        self._data[k] = (v, time.time() + self.ttl)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(k)
+
+        t = threading.Thread(target=run, name="registry-cache-refresh")
+        t.daemon = True
+        t.start()
+
 
 class RedisRegistry(Registry):
 
     _redis_key_prefix = "servicelib.url.".encode("utf-8")
 
+    _redis_index_key = "servicelib.services".encode("utf-8")
+
+    _redis_lease_prefix = "servicelib.lease."
+
+    # Sets of the URLs of each service whose workers renew leases.
+    _redis_leased_prefix = "servicelib.leased."
+
+    _redis_load_prefix = "servicelib.load."
+
+    _redis_sockets_key = "servicelib.sockets".encode("utf-8")
+
+    _redis_channel = "servicelib.registry"
+
     log = logutils.get_logger(__name__)
 
     def __init__(self):
         super(RedisRegistry, self).__init__()
         self._pool = RedisPool()
+        self.lease_ttl = float(config.get("registry.lease_ttl", default=0))
+        self._cache = None
+        cache_ttl = float(config.get("registry.cache_ttl", default=5))
+        if cache_ttl > 0:
+            self._cache = Cache(cache_ttl, self._fetch_service_urls)
+        self._watch = config.get("registry.pubsub", default=True)
+        self._watcher_pid = None
+        self._watcher_lock = threading.Lock()
+        self._sockets = Cache(
+            float(config.get("registry.cache_ttl", default=5)) or 5,
+            self._fetch_socket_path,
+        )
+        self._loads = Cache(
+            float(config.get("registry.load_interval", default=5)) or 5,
+            self._fetch_worker_load,
+        )
 
     def register(self, services):
         p = self._pool.connection().pipeline()
         for (name, url) in services:
             k = self.redis_key(name)
             self.log.info("Registering service %s at %s", name, url)
+            self._renew_lease(p, name, url)
             p.sadd(k, url.encode("utf-8"))
+            p.sadd(self._redis_index_key, name.encode("utf-8"))
+        self._publish(p, services)
         p.execute()
+        self._invalidate(name for (name, _) in services)
 
     def unregister(self, services):
         p = self._pool.connection().pipeline()
@@ -99,59 +672,200 @@ class RedisRegistry(Registry):
             k = self.redis_key(name)
             self.log.info("Unregistering service %s at %s", name, url)
             p.srem(k, url)
+            p.srem(self.leased_key(name), url)
+            if self.lease_ttl > 0:
+                p.delete(self.lease_key(url))
+        self._publish(p, services)
         p.execute()
+        self._invalidate(name for (name, _) in services)
 
-    # def service_url(self, name, local_only=False):
-    def service_url(self, name):
-        # TODO: Cache results.
-        c = self._pool.connection()
-        k = self.redis_key(name)
+    def heartbeat(self, services):
+        if self.lease_ttl <= 0:
+            return
+        p = self._pool.connection().pipeline()
+        for (name, url) in services:
+            self._renew_lease(p, name, url)
+            # Put ourselves back, in case we were reaped while unable to
+            # reach Redis.
+            p.sadd(self.redis_key(name), url.encode("utf-8"))
+            p.sadd(self._redis_index_key, name.encode("utf-8"))
+        p.execute()
 
-        # url = None
-        # if local_only:
-        #     for parsed, unparsed in [(urlparse(u), u) for u in c.smembers(k)]:
-        #         if parsed.netloc.split(":")[0] == HOSTNAME:
-        #             url = unparsed
-        #             break
-        # else:
-        #     url = c.srandmember(k)
-        url = c.srandmember(k)
-
-        if url is None:
-            # raise Exception(
-            #     "No URL for service {} (local-only: {})".format(name, local_only)
-            # )
-            raise Exception("No URL for service {}".format(name))
+    def _renew_lease(self, pipeline, name, url):
+        if self.lease_ttl > 0:
+            pipeline.set(self.lease_key(url), b"1", px=int(self.lease_ttl * 1000))
+            pipeline.sadd(self.leased_key(name), url.encode("utf-8"))
+
+    def register_socket(self, netloc, path):
+        self.log.info("Registering Unix socket %s for %s", path, netloc)
+        self._pool.connection().hset(
+            self._redis_sockets_key, netloc.encode("utf-8"), path.encode("utf-8")
+        )
+        self._sockets.invalidate(netloc)
+
+    def unregister_socket(self, netloc):
+        self.log.info("Unregistering Unix socket for %s", netloc)
+        self._pool.connection().hdel(self._redis_sockets_key, netloc.encode("utf-8"))
+        self._sockets.invalidate(netloc)
+
+    def socket_path(self, netloc):
+        return self._sockets.get(netloc)
+
+    def _fetch_socket_path(self, netloc):
+        ret = self._pool.connection().hget(
+            self._redis_sockets_key, netloc.encode("utf-8")
+        )
+        if ret is not None:
+            ret = ret.decode("utf-8")
+        return ret
 
-        return url.decode("utf-8")
+    def publish_load(self, netloc, load, ttl):
+        k = self.load_key(netloc)
+        p = self._pool.connection().pipeline()
+        p.hset(k, load_slot(), json.dumps(load))
+        p.pexpire(k, int(ttl * 1000))
+        p.execute()
 
-    def services_by_name(self):
-        ret = {}
+    def worker_load(self, netloc):
+        return self._loads.get(netloc)
+
+    def _fetch_worker_load(self, netloc):
+        loads = self._pool.connection().hgetall(self.load_key(netloc))
+        if not loads:
+            return None
+        loads = [json.loads(v) for v in loads.values()]
+        return {
+            "busy": sum(x["busy"] for x in loads),
+            "capacity": sum(x["threads"] for x in loads),
+            "queue": max(x["queue"] for x in loads),
+            "cpu": max(x["cpu"] for x in loads),
+        }
+
+    def reap(self, name):
+        """Removes the URLs of service `name` whose lease has expired.
+
+        Returns the URLs with a lease. URLs of workers which never renewed
+        one (such as workers with no ``registry.lease_ttl``) are left out,
+        but not removed.
+
+        """
         c = self._pool.connection()
-        cur = 0
+        k = self.redis_key(name)
+        urls = sorted(u.decode("utf-8") for u in c.smembers(k))
+        if self.lease_ttl <= 0 or not urls:
+            return urls
+
+        p = c.pipeline(transaction=False)
+        p.mget([self.lease_key(u) for u in urls])
+        p.smembers(self.leased_key(name))
+        leases, leased = p.execute()
+        leased = set(u.decode("utf-8") for u in leased)
+        dead = [
+            u for (u, lease) in zip(urls, leases) if lease is None and u in leased
+        ]
+        if dead:
+            self.log.info("Reaping dead workers of service %s: %s", name, dead)
+            p = c.pipeline()
+            dead = [u.encode("utf-8") for u in dead]
+            p.srem(k, *dead)
+            p.srem(self.leased_key(name), *dead)
+            self._publish(p, [(name, None)])
+            p.execute()
+        return [u for (u, lease) in zip(urls, leases) if lease is not None]
+
+    def _publish(self, pipeline, services):
+        for name in set(name for (name, _) in services):
+            pipeline.publish(self._redis_channel, name.encode("utf-8"))
+
+    def _start_watcher(self):
+        """Starts the thread which keeps the URL cache of this process up to
+        date, unless it is already running.
+
+        """
+        with self._watcher_lock:
+            pid = os.getpid()
+            if self._watcher_pid == pid:
+                return
+            self._watcher_pid = pid
+        t = threading.Thread(target=self._watcher, name="registry-watcher")
+        t.daemon = True
+        t.start()
+
+    def _watcher(self):
         while True:
-            cur, keys = c.scan(cur)
-            self.log.debug("services_by_name(): keys: %s", keys)
-            for k in keys:
-                self.log.debug("services_by_name(): %s ?", k)
-                if k.startswith(self._redis_key_prefix):
-                    self.log.debug("services_by_name(): Yep: %s", k)
-                    ret.setdefault(
-                        k[len(self._redis_key_prefix) :].decode("utf-8"), set()
-                    )
-            if cur == 0:
-                break
-        self.log.debug("services_by_name(): ret: %s", ret)
-        for k, urls in ret.items():
-            for url in c.smembers(self.redis_key(k)):
-                urls.add(url.decode("utf-8"))
+            try:
+                p = self._pool.connection().pubsub(ignore_subscribe_messages=True)
+                p.subscribe(self._redis_channel)
+                # Changes may have been missed while not subscribed.
+                self._cache.expire_all()
+                for msg in p.listen():
+                    if msg["type"] == "message":
+                        name = msg["data"].decode("utf-8")
+                        self.log.debug("URLs of service %s changed", name)
+                        self._cache.invalidate(name)
+            except Exception as exc:
+                self.log.warning("Lost registry change notifications: %s", exc)
+                time.sleep(1)
+
+    def _invalidate(self, names):
+        if self._cache is not None:
+            for name in set(names):
+                self._cache.invalidate(name)
+
+    def service_urls(self, name):
+        if self._cache is None:
+            return self._fetch_service_urls(name)
+        if self._watch:
+            self._start_watcher()
+        urls = self._cache.get(name)
+        if not urls:
+            # Do not remember services with no workers, they may show up
+            # any time.
+            self._cache.invalidate(name)
+        return urls
+
+    def _fetch_service_urls(self, name):
+        return self.reap(name)
+
+    def services_by_name(self):
+        c = self._pool.connection()
+        names = sorted(n.decode("utf-8") for n in c.smembers(self._redis_index_key))
+        if not names:
+            # Services registered before the index existed.
+            names = self._scan_service_names(c)
+        self.log.debug("services_by_name(): names: %s", names)
+
+        p = c.pipeline(transaction=False)
+        for name in names:
+            p.smembers(self.redis_key(name))
+        ret = {}
+        for name, urls in zip(names, p.execute()):
+            if urls:
+                ret[name] = set(u.decode("utf-8") for u in urls)
+        return ret
+
+    def _scan_service_names(self, c):
+        ret = []
+        for k in c.scan_iter(match=self._redis_key_prefix + b"*"):
+            ret.append(k[len(self._redis_key_prefix) :].decode("utf-8"))
         return ret
 
     def redis_key(self, service_name):
         return self._redis_key_prefix + service_name.encode("utf-8")
 
+    def load_key(self, netloc):
+        return (self._redis_load_prefix + netloc).encode("utf-8")
+
+    def lease_key(self, url):
+        return (self._redis_lease_prefix + url).encode("utf-8")
+
+    def leased_key(self, service_name):
+        return (self._redis_leased_prefix + service_name).encode("utf-8")
+
 
 _INSTANCE_MAP = {
+    "file": FileRegistry,
+    "memory": MemoryRegistry,
     "no-op": NoOpRegistry,
     "redis": RedisRegistry,
 }
@@ -171,29 +885,6 @@ def instance():
 LOG = logutils.get_logger(__name__)
 
 
-# class Cache(object):
-#     def __init__(self, ttl):
-#         self.ttl = ttl
-#         self._data = {}
-
-#     def get(self, k):
-#         v, expires = self._data[k]
-#         now = time.time()
-#         if now > expires:
-#             try:
-#                 del self._data[k]
-#             except KeyError:
-#                 pass
-#             raise KeyError(k)
-#         return v
-
-#     def put(self, k, v):
-#         self._data[k] = (v, time.time() + self.ttl)
-
-
-# _CACHE = Cache(int(config.get("registry.cache_ttl", default=5)))
-
-
 # def services_by_netloc():
 #     ret = {}
 #     for service, urls in services_by_name().items():
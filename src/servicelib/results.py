@@ -19,13 +19,14 @@ import tempfile
 import uuid
 
 from servicelib import config, logutils
-from servicelib.compat import PY2, Path, open, urlparse
+from servicelib.compat import PY2, Path, open, string_types, urlparse
 
 
 __all__ = [
     "Result",
     "Results",
     "instance",
+    "result_hosts",
 ]
 
 
@@ -303,6 +304,33 @@ _INSTANCE_MAP = {
 }
 
 
+def result_hosts(thing):
+    """Returns the set of hosts holding the results referred to in `thing`.
+
+    `thing` is any JSON-serialisable value, such as the arguments of a
+    service call. Results are dicts as returned by `Result.as_dict()`.
+
+    """
+    ret = set()
+    stack = [thing]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, dict):
+            location = v.get("location")
+            if "contentType" in v and isinstance(location, string_types):
+                try:
+                    host = urlparse(location).hostname
+                except ValueError:
+                    host = None
+                if host:
+                    ret.add(host)
+            else:
+                stack.extend(v.values())
+        elif isinstance(v, (list, tuple)):
+            stack.extend(v)
+    return ret
+
+
 def instance():
     class_name = config.get("results.class", default="http-files")
     try:
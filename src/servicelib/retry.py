@@ -0,0 +1,104 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""Retry policies for service calls."""
+
+from __future__ import absolute_import, unicode_literals
+
+import random
+
+import requests
+
+from servicelib import config, errors
+
+
+__all__ = [
+    "RetryPolicy",
+    "default_policy",
+]
+
+
+class RetryPolicy(object):
+
+    """Decides whether, and when, failed service calls are retried.
+
+    A call is attempted at most `max_attempts` times. Errors are retried
+    when their ``retry`` attribute is true (see `servicelib.errors`), or when
+    the service could not be reached at all.
+
+    Retries wait for the delay of `servicelib.errors.RetryLater` errors.
+    Otherwise they wait for an exponential backoff, starting at `backoff`
+    seconds and capped at `max_backoff`, with full jitter.
+
+    """
+
+    def __init__(self, max_attempts=1, backoff=0.1, max_backoff=10.0, jitter=True):
+        self.max_attempts = int(max_attempts)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.jitter = jitter
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            max_attempts=config.get("client.retry.max_attempts", default=1),
+            backoff=config.get("client.retry.backoff", default=0.1),
+            max_backoff=config.get("client.retry.max_backoff", default=10.0),
+        )
+
+    def with_attempts(self, max_attempts):
+        """Returns a copy of this policy, allowing `max_attempts` attempts."""
+        return self.__class__(
+            max_attempts=max_attempts,
+            backoff=self.backoff,
+            max_backoff=self.max_backoff,
+            jitter=self.jitter,
+        )
+
+    def should_retry(self, exc, attempt):
+        """Returns true if a call which failed with `exc` on its `attempt`-th
+        attempt should be attempted again.
+
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if isinstance(exc, (errors.RetryLater, requests.ConnectionError)):
+            return True
+        return bool(getattr(exc, "retry", False))
+
+    def delay(self, exc, attempt):
+        """Returns the number of seconds to wait before retrying a call which
+        failed with `exc` on its `attempt`-th attempt.
+
+        """
+        if isinstance(exc, errors.RetryLater):
+            return float(exc.delay)
+        ret = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+        if self.jitter:
+            ret = random.uniform(0, ret)
+        return ret
+
+    def __repr__(self):
+        return "RetryPolicy(max_attempts={!r}, backoff={!r}, max_backoff={!r})".format(
+            self.max_attempts, self.backoff, self.max_backoff
+        )
+
+
+_DEFAULT_POLICY = None
+
+
+def default_policy():
+    """Returns the policy for calls which do not specify one, as per the
+    ``client.retry.*`` config settings.
+
+    """
+    global _DEFAULT_POLICY
+    if _DEFAULT_POLICY is None:
+        _DEFAULT_POLICY = RetryPolicy.from_config()
+    return _DEFAULT_POLICY
@@ -15,6 +15,7 @@ import os
 import platform
 import sys
 
+from servicelib import encoding
 from servicelib.context.service import ServiceContext
 from servicelib.core import Response
 from servicelib.errors import Serializable, TaskError
@@ -56,7 +57,7 @@ class ServiceInstance(object):
         """User-provided service implementation."""
         raise NotImplementedError()
 
-    def _execute(self, req):
+    def _execute(self, req, media_types=(encoding.JSON,)):
         context = ServiceContext(self.name, self.home, None, req)
         with context.timer("elapsed") as timer:
             context.metadata.start()
@@ -94,13 +95,15 @@ class ServiceInstance(object):
 
         res = Response(result, context.metadata)
         try:
-            # Force the JSON encoding of this response, so that we may
-            # trap serialization errors and return a proper error
+            # Force the encoding of this response in one of `media_types`, so
+            # that we may trap serialization errors and return a proper error
             # response.
-            res.http_body
+            res.encode(media_types)
         except Exception as exc:
             exc_type, _, exc_tb = sys.exc_info()
-            exc = exc_type("Cannot encode <{}> as JSON: {}".format(res, exc))
+            exc = exc_type(
+                "Cannot encode <{}> as {}: {}".format(res, media_types[-1], exc)
+            )
             res = Response(
                 TaskError(self.name, exc_type, exc, exc_tb), context.metadata
             )
@@ -0,0 +1,117 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+"""HTTP over Unix domain sockets, for `requests`.
+
+URLs have the form ``http+unix://<socket path>/<request path>``, with the
+socket path percent-encoded (see `unix_url()`).
+
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import socket
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+from servicelib.compat import quote, unquote, urlparse
+from servicelib.hedging import CancellableConnectionMixin
+
+
+__all__ = [
+    "UnixAdapter",
+    "unix_url",
+]
+
+
+SCHEME = "http+unix"
+
+
+def unix_url(socket_path, url):
+    """Returns the URL for sending requests for `url` through the Unix socket
+    at `socket_path`.
+
+    """
+    u = urlparse(url)
+    path = u.path
+    if u.query:
+        path = "{}?{}".format(path, u.query)
+    return "{}://{}{}".format(SCHEME, quote(socket_path, safe=""), path)
+
+
+class UnixHTTPConnection(CancellableConnectionMixin, HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        self.socket_path = kwargs.pop("socket_path")
+        super(UnixHTTPConnection, self).__init__(*args, **kwargs)
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+
+    scheme = SCHEME
+
+    ConnectionCls = UnixHTTPConnection
+
+    def __init__(self, socket_path, **kwargs):
+        super(UnixHTTPConnectionPool, self).__init__(
+            "localhost", socket_path=socket_path, **kwargs
+        )
+        self.socket_path = socket_path
+
+
+class UnixAdapter(HTTPAdapter):
+
+    """Transport adapter sending requests for ``http+unix://`` URLs.
+
+    Keeps one pool of up to `pool_maxsize` keep-alive connections per socket.
+
+    """
+
+    def __init__(self, pool_maxsize=10, **kwargs):
+        super(UnixAdapter, self).__init__(pool_maxsize=pool_maxsize, **kwargs)
+        self._unix_maxsize = pool_maxsize
+        self.unix_pools = {}
+        self._unix_lock = threading.Lock()
+
+    def get_connection(self, url, proxies=None):
+        socket_path = unquote(urlparse(url).netloc)
+        with self._unix_lock:
+            pool = self.unix_pools.get(socket_path)
+            if pool is None:
+                pool = UnixHTTPConnectionPool(
+                    socket_path, maxsize=self._unix_maxsize, block=False
+                )
+                self.unix_pools[socket_path] = pool
+        return pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self.get_connection(request.url, proxies)
+
+    def request_url(self, request, proxies):
+        return request.path_url
+
+    def close(self):
+        super(UnixAdapter, self).close()
+        with self._unix_lock:
+            pools, self.unix_pools = self.unix_pools, {}
+        for pool in pools.values():
+            pool.close()
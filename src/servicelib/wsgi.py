@@ -18,7 +18,13 @@ import falcon
 
 from servicelib import config, inventory, logutils, registry
 from servicelib.compat import raise_from
-from servicelib.falcon import HealthResource, StatsResource, WorkerResource
+from servicelib.falcon import (
+    BatchResource,
+    HealthResource,
+    StatsResource,
+    WorkerResource,
+    worker_load,
+)
 
 
 __all__ = [
@@ -38,16 +44,24 @@ application = falcon.API(media_type=falcon.MEDIA_JSON)
 try:
     services = inventory.instance().load_services()
     application.add_route("/services/{service}", WorkerResource(services))
+    application.add_route("/batch", BatchResource(services))
 
     # Now that routes for services have been set up, we may add the services we
     # host here to the service registry.
     worker_hostname = config.get("worker.hostname")
     worker_port = config.get("worker.port")
+    worker_netloc = "{}:{}".format(worker_hostname, worker_port)
     service_urls = [
-        (name, "http://{}:{}/services/{}".format(worker_hostname, worker_port, name,),)
-        for name in services
+        (name, "http://{}/services/{}".format(worker_netloc, name)) for name in services
     ]
     registry.instance().register(service_urls)
+    registry.instance().keep_alive(service_urls)
+    registry.instance().report_load(worker_netloc, worker_load)
+
+    # Let clients on this host know they may skip TCP.
+    unix_socket = config.get("worker.unix_socket", default=None)
+    if unix_socket is not None:
+        registry.instance().register_socket(worker_netloc, unix_socket)
 
     # Now that routes for services have been set up, we are ready to
     # handle requests. Let Kubernetes know (or whoever may be sending
@@ -58,6 +72,8 @@ try:
     @atexit.register
     def unregister():
         registry.instance().unregister(service_urls)
+        if unix_socket is not None:
+            registry.instance().unregister_socket(worker_netloc)
 
     application.add_route("/stats", StatsResource())
 except Exception as exc:
@@ -0,0 +1,152 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import pprint
+import time
+
+import pytest
+
+from servicelib import aio, circuit, errors, registry
+from servicelib.aio import AsyncBroker
+from servicelib.compat import env_var
+from servicelib.timer import Timer
+
+
+@pytest.fixture
+def async_broker(request, cache, worker, monkeypatch):
+    monkeypatch.setenv(
+        *env_var("SERVICELIB_CONFIG_URL", worker.servicelib_yaml_file.as_uri())
+    )
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_CLASS", "redis"))
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_URL", "redis://localhost/0"))
+    # Circuits opened by calls timing out in earlier tests stay open.
+    monkeypatch.setattr(circuit, "_BREAKERS", None)
+    b = AsyncBroker()
+    try:
+        yield b
+    finally:
+        b.close()
+
+
+def test_call(async_broker):
+    async def f():
+        return await async_broker.execute("dump_request", "foo", 42, None, True)
+
+    res = asyncio.run(f())
+    assert res["args"] == ["foo", 42, None, True]
+
+
+def test_many_calls_in_flight(async_broker):
+    async def f():
+        calls = [async_broker.execute("echo", i) for i in range(100)]
+        return await asyncio.gather(*calls)
+
+    assert asyncio.run(f()) == [[i] for i in range(100)]
+
+
+def test_service_url_lookup_does_not_block_loop(monkeypatch):
+    monkeypatch.setenv("SERVICELIB_CONFIG_URL", "file:///dev/null")
+
+    class SlowRegistry(object):
+        def service_url(self, service, **kwargs):
+            time.sleep(0.5)
+            raise errors.CommError("No workers for {}".format(service))
+
+    monkeypatch.setattr(registry, "instance", SlowRegistry)
+
+    async def f():
+        ticks = []
+        res = AsyncBroker().execute("echo", "foo")
+        for _ in range(5):
+            ticks.append(time.time())
+            await asyncio.sleep(0.05)
+        with pytest.raises(errors.CommError):
+            await res
+        return ticks
+
+    ticks = asyncio.run(f())
+    assert ticks[-1] - ticks[0] < 0.4
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("http://example.com/services/echo", ("example.com", 80, False)),
+        ("https://example.com/services/echo", ("example.com", 443, True)),
+        ("https://example.com:8443/services/echo", ("example.com", 8443, True)),
+        ("ftp://example.com/services/echo", None),
+    ],
+)
+def test_url_schemes(monkeypatch, url, expected):
+    monkeypatch.setenv("SERVICELIB_CONFIG_URL", "file:///dev/null")
+
+    class OneWorker(object):
+        def service_url(self, service, **kwargs):
+            return url
+
+    monkeypatch.setattr(registry, "instance", OneWorker)
+    connections = []
+
+    async def open_connection(host, port, ssl=False):
+        connections.append((host, port, ssl))
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr(asyncio, "open_connection", open_connection)
+
+    async def f():
+        b = AsyncBroker()
+        try:
+            await b.execute("echo", "foo")
+        finally:
+            b.close()
+
+    if expected is None:
+        with pytest.raises(aio.HttpError):
+            asyncio.run(f())
+        assert connections == []
+    else:
+        with pytest.raises(ConnectionRefusedError):
+            asyncio.run(f())
+        assert connections == [expected]
+
+
+def test_call_with_error(async_broker):
+    async def f():
+        await async_broker.execute("raise", "BadRequest", "some-error")
+
+    with pytest.raises(errors.BadRequest) as exc:
+        asyncio.run(f())
+    assert str(exc.value) == "some-error"
+
+
+def test_metadata(async_broker):
+    async def f():
+        return await async_broker.execute("proxy", "echo", "foo").wait()
+
+    _, metadata = asyncio.run(f())
+    top = metadata.as_dict()["kids"][0]
+    assert top["task"] == "proxy", pprint.pformat(top)
+    assert top["kids"][0]["task"] == "echo", pprint.pformat(top)
+
+
+def test_timeout_in_call(async_broker):
+    timeout = 1
+    delay = timeout + 0.5
+
+    async def f():
+        await async_broker.execute("sleep", delay, timeout=timeout)
+
+    with Timer() as t:
+        with pytest.raises(errors.Timeout) as exc:
+            asyncio.run(f())
+    assert exc.value.args[0].endswith("/services/sleep")
+    assert t.elapsed < delay
@@ -0,0 +1,116 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+from __future__ import absolute_import, unicode_literals
+
+import collections
+
+import pytest
+
+from servicelib import balancer, registry
+from servicelib.compat import env_var
+
+
+@pytest.fixture
+def load(monkeypatch):
+    ret = balancer.Load(alpha=0.5)
+    monkeypatch.setattr(balancer, "_LOAD", ret)
+    return ret
+
+
+def test_load(load):
+    load.started("a")
+    load.started("a")
+    assert load.in_flight("a") == 2
+    assert load.latency("a") == 0.0
+
+    load.finished("a", 1.0)
+    assert load.in_flight("a") == 1
+    assert load.latency("a") == 1.0
+
+    load.finished("a", 3.0)
+    assert load.in_flight("a") == 0
+    assert load.latency("a") == 2.0
+
+
+def test_random(load):
+    b = balancer.RandomBalancer()
+    assert sorted(b.order(["a", "b", "c"])) == ["a", "b", "c"]
+    firsts = collections.Counter(b.order(["a", "b"])[0] for _ in range(100))
+    assert set(firsts) == {"a", "b"}
+
+
+def test_least_outstanding(load):
+    b = balancer.LeastOutstandingBalancer()
+    load.started("a")
+    load.started("a")
+    load.started("b")
+    assert b.order(["a", "b", "c"]) == ["c", "b", "a"]
+
+    load.started("c")
+    load.finished("c", 1.0)
+    load.started("c")
+    load.finished("b", 0.1)
+    load.started("b")
+    # Same number of calls in flight, `b` is faster.
+    assert b.order(["b", "c"]) == ["b", "c"]
+    assert b.order(["c", "b"]) == ["b", "c"]
+
+
+def test_power_of_two(load):
+    b = balancer.PowerOfTwoBalancer()
+    load.started("slow")
+    load.finished("slow", 10.0)
+    load.started("fast")
+    load.finished("fast", 0.1)
+    for _ in range(20):
+        assert b.order(["slow", "fast"])[0] == "fast"
+
+    # Loaded workers lose to idle ones.
+    for _ in range(200):
+        load.started("fast")
+    for _ in range(20):
+        assert b.order(["slow", "fast"])[0] == "slow"
+
+
+def test_instance(monkeypatch):
+    assert isinstance(balancer.instance(), balancer.RandomBalancer)
+
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_BALANCER", "power-of-two"))
+    assert isinstance(balancer.instance(), balancer.PowerOfTwoBalancer)
+
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_BALANCER", "no-such-impl"))
+    with pytest.raises(Exception) as exc:
+        balancer.instance()
+    assert str(exc.value) == "Invalid value for `registry.balancer`: no-such-impl"
+
+
+def test_capacity(monkeypatch):
+    loads = {
+        "idle:8000": {"busy": 0, "capacity": 8, "queue": 0, "cpu": 0.0},
+        "busy:8000": {"busy": 8, "capacity": 8, "queue": 4, "cpu": 0.0},
+        "hot:8000": {"busy": 0, "capacity": 8, "queue": 0, "cpu": 100.0},
+    }
+
+    class Registry(registry.Registry):
+        def worker_load(self, netloc):
+            return loads.get(netloc)
+
+    monkeypatch.setattr(registry, "instance", Registry)
+    b = balancer.CapacityBalancer()
+
+    urls = ["http://{}/services/foo".format(k) for k in sorted(loads)]
+    firsts = collections.Counter(b.order(urls)[0] for _ in range(1000))
+    assert firsts["http://idle:8000/services/foo"] > 990
+
+    # Workers which did not report their load get the average weight.
+    urls.append("http://unknown:8000/services/foo")
+    firsts = collections.Counter(b.order(urls)[0] for _ in range(1000))
+    assert 600 < firsts["http://idle:8000/services/foo"] < 850
+    assert 150 < firsts["http://unknown:8000/services/foo"] < 400
@@ -0,0 +1,78 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from servicelib import circuit, core, errors
+
+
+def test_opens_after_consecutive_failures():
+    b = circuit.CircuitBreaker("http://foo", failure_threshold=3, reset_timeout=60)
+    b.record_failure()
+    b.record_failure()
+    b.record_success()
+    b.record_failure()
+    b.record_failure()
+    assert b.state == b.CLOSED
+    assert b.allow()
+
+    b.record_failure()
+    assert b.state == b.OPEN
+    assert not b.allow()
+
+
+def test_half_open_probe():
+    b = circuit.CircuitBreaker("http://foo", failure_threshold=1, reset_timeout=0.1)
+    b.record_failure()
+    assert not b.allow()
+
+    time.sleep(0.2)
+    assert b.allow()
+    assert b.state == b.HALF_OPEN
+    # Only one probe at a time.
+    assert not b.allow()
+
+    # A failed probe opens the circuit again.
+    b.record_failure()
+    assert b.state == b.OPEN
+    assert not b.allow()
+
+    time.sleep(0.2)
+    assert b.allow()
+    b.record_success()
+    assert b.state == b.CLOSED
+    assert b.allow()
+    assert b.allow()
+
+
+def test_breakers():
+    breakers = circuit.CircuitBreakers(failure_threshold=2, reset_timeout=60)
+    ok = core.Response(42, None)
+    breakers.record("http://foo", errors.Timeout("http://foo"))
+    breakers.record("http://foo", errors.Timeout("http://foo"))
+    breakers.record("http://bar", errors.Timeout("http://bar"))
+    breakers.record("http://bar", ok)
+    breakers.record("http://bar", errors.Timeout("http://bar"))
+    assert not breakers.allow("http://foo")
+    assert breakers.allow("http://bar")
+    assert breakers.allow("http://baz")
+
+    # Errors returned by services do not count as failures.
+    breakers.record("http://baz", core.Response(errors.BadRequest("no"), None))
+    breakers.record("http://baz", core.Response(errors.BadRequest("no"), None))
+    assert breakers.allow("http://baz")
+
+
+def test_breakers_disabled():
+    breakers = circuit.CircuitBreakers(failure_threshold=0)
+    for _ in range(10):
+        breakers.record("http://foo", errors.Timeout("http://foo"))
+    assert breakers.allow("http://foo")
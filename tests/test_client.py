@@ -10,13 +10,17 @@
 from __future__ import absolute_import, unicode_literals
 
 import json
+import os
 import pprint
+import subprocess
+import sys
 import threading
 import time
 
 import pytest
 
-from servicelib import client, errors
+from servicelib import client, core, encoding, errors, registry, service
+from servicelib.metadata import Metadata
 from servicelib.compat import env_var
 from servicelib.timer import Timer
 
@@ -29,6 +33,22 @@ def test_call(broker):
     assert res["args"] == ["foo", 42, 42.0, None, True, False]
 
 
+def test_call_kwargs(broker):
+    res = broker.execute(
+        "dump_request",
+        "foo",
+        timeout=10,
+        deadline=30,
+        retry=2,
+        hedge=False,
+        **{"some-key": "some-value"}
+    ).result
+    notes = res["metadata"]["notes"]
+    assert notes["some-key"] == "some-value"
+    for k in ("timeout", "deadline", "retry", "hedge"):
+        assert k not in notes
+
+
 def test_call_with_non_serializable_arg(broker):
     with pytest.raises(Exception) as exc:
         broker.execute("echo", object())
@@ -133,6 +153,293 @@ def test_parallel_requests(broker):
     assert t.elapsed < 2 * delay + overhead
 
 
+def test_queue_time_in_metadata(broker):
+    res = broker.execute("echo", "foo")
+    top = res.metadata.as_dict()["kids"][0]
+    assert top["timers"]["queue"]["elapsed"] >= 0, pprint.pformat(top)
+
+
+def test_brokers_share_executor():
+    b1 = client.Broker()
+    b2 = client.Broker()
+    try:
+        assert b1.executor is client.executor()
+        assert b2.executor is client.executor()
+    finally:
+        b1.close()
+        b2.close()
+
+
+def test_pending_calls_do_not_block_exit():
+    code = (
+        "import time\n"
+        "from servicelib import client\n"
+        "client.executor().submit(time.sleep, 60)\n"
+    )
+    env = dict(os.environ, SERVICELIB_CONFIG_URL="file:///dev/null")
+    started = time.time()
+    subprocess.check_call([sys.executable, "-c", code], env=env)
+    assert time.time() - started < 30
+
+
+def test_daemon_executor():
+    pool = client.DaemonThreadPoolExecutor(2)
+    try:
+        assert list(pool.map(lambda x: x * 2, range(10))) == list(range(0, 20, 2))
+        assert len(pool._threads) <= 2
+        assert all(t.daemon for t in pool._threads)
+        with pytest.raises(ZeroDivisionError):
+            pool.submit(lambda: 1 / 0).result()
+    finally:
+        pool.shutdown()
+    with pytest.raises(RuntimeError):
+        pool.submit(time.sleep, 0)
+
+
+def test_map(broker):
+    res = list(broker.map("echo", ["foo", ("bar", 42), 42.0]))
+    expected = [["foo"], ["bar", 42], [42.0]]
+    assert sorted((r[1] for r in res), key=str) == sorted(expected, key=str)
+    for args, value, metadata in res:
+        assert list(args) == value
+        assert metadata.as_dict()["task"] == "echo"
+
+
+def test_map_completion_order(broker):
+    res = broker.map("sleep", [2, 0, 1], concurrency=3)
+    assert [args for (args, _, _) in res] == [(0,), (1,), (2,)]
+
+    res = broker.map("sleep", [2, 0, 1], concurrency=3, ordered=True)
+    assert [args for (args, _, _) in res] == [(2,), (0,), (1,)]
+
+
+def test_map_concurrency(broker):
+    delay = 1
+    with Timer() as t:
+        res = list(broker.map("sleep", [delay] * 4, concurrency=2))
+    assert len(res) == 4
+    assert t.elapsed >= 2 * delay
+
+
+def test_map_errors(broker):
+    res = list(broker.map("raise", [("BadRequest", "some-error")]))
+    assert len(res) == 1
+    _, exc, _ = res[0]
+    assert isinstance(exc, errors.BadRequest)
+
+
+def test_map_deadline(broker):
+    deadline = 2
+    with Timer() as t:
+        res = list(broker.map("sleep", [0, 1, deadline + 2], deadline=deadline))
+    assert sorted(args for (args, _, _) in res) == [(0,), (1,)]
+    assert t.elapsed < deadline + 1
+
+    with Timer() as t:
+        res = list(
+            broker.map("sleep", [deadline + 2, 0, 1], deadline=deadline, ordered=True)
+        )
+    assert [args for (args, _, _) in res] == [(0,), (1,)]
+    assert t.elapsed < deadline + 1
+
+
+def test_execute_batch(broker):
+    res = broker.execute_batch(
+        [
+            ("echo", ["foo"]),
+            ("dump_request", ("bar", 42), {"some-key": "some-value"}),
+            ("raise", ["BadRequest", "some-error"]),
+        ]
+    )
+    assert [type(r) for r in res] == [client.BatchResult] * 3
+    assert res[0].result == ["foo"]
+    assert res[1].result["args"] == ["bar", 42]
+    assert res[1].result["metadata"]["notes"]["some-key"] == "some-value"
+    with pytest.raises(errors.BadRequest) as exc:
+        res[2].result
+    assert str(exc.value) == "some-error"
+
+    assert res[0].call_metadata.as_dict()["task"] == "echo"
+    tasks = sorted(k["task"] for k in res[0].metadata.as_dict()["kids"])
+    assert tasks == ["dump_request", "echo", "raise"]
+
+
+def test_batch_endpoint(worker):
+    res = worker.http_post(
+        "/batch",
+        json=[
+            {"service": "echo", "args": ["foo"]},
+            {"service": "no-such-service", "args": []},
+        ],
+    )
+    assert len(res) == 2
+    assert res[0]["status"] == 200
+    assert res[0]["value"] == ["foo"]
+    assert res[1]["status"] == 400
+    assert res[1]["value"]["exc_type"] == "servicelib.errors.BadRequest"
+
+
+def test_batch_items_run_concurrently(worker):
+    delay = 1
+    with Timer() as t:
+        res = worker.http_post(
+            "/batch", json=[{"service": "sleep", "args": [delay]}] * 3,
+        )
+    assert [r["value"] for r in res] == [delay] * 3
+    assert t.elapsed < 2 * delay
+
+
+def test_batch_threads_default_to_worker_threads(monkeypatch):
+    from servicelib import falcon
+
+    monkeypatch.setenv("SERVICELIB_CONFIG_URL", "file:///dev/null")
+    assert falcon.batch_threads() == 1
+    monkeypatch.setenv(*env_var("SERVICELIB_WORKER_NUM_THREADS", "3"))
+    assert falcon.batch_threads() == 3
+    monkeypatch.setenv(*env_var("SERVICELIB_WORKER_BATCH_THREADS", "8"))
+    assert falcon.batch_threads() == 8
+
+
+def test_sessions_are_per_thread():
+    t = client.HttpTransport(pool_maxsize=4)
+    sessions = []
+
+    def f():
+        sessions.append(t.session)
+        sessions.append(t.session)
+
+    try:
+        threads = [threading.Thread(target=f) for _ in range(2)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert sessions[0] is sessions[1]
+        assert sessions[2] is sessions[3]
+        assert sessions[0] is not sessions[2]
+        assert sessions[0].get_adapter("http://foo")._pool_maxsize == 4
+    finally:
+        t.close()
+
+
+def test_pool_stats(broker, worker):
+    def counters():
+        stats = broker.pool_stats()
+        return stats.get(
+            "http://{}:{}".format(worker.host, worker.port), {"hits": 0, "misses": 0}
+        )
+
+    before = counters()
+    for _ in range(3):
+        broker.execute("echo", "foo").result
+    after = counters()
+
+    num_requests = sum(after.values()) - sum(before.values())
+    assert num_requests == 3, (before, after)
+
+
+def test_brokers_share_transport(context):
+    b1 = client.Broker()
+    b2 = client.Broker()
+    try:
+        assert b1.transport is client.transport()
+        assert b2.transport is client.transport()
+        assert context.broker.transport is client.transport()
+    finally:
+        b1.close()
+        b2.close()
+
+
+def test_retry(broker):
+    delay = 1
+    res = broker.execute("raise", "RetryLater", "some-error", delay, retry=2)
+    with Timer() as t:
+        with pytest.raises(errors.RetryLater):
+            res.result
+    assert t.elapsed >= delay
+    assert len(res.attempt_timers) == 2
+
+    res = broker.execute("raise", "BadRequest", "some-error", retry=2)
+    with pytest.raises(errors.BadRequest):
+        res.result
+    assert len(res.attempt_timers) == 1
+
+
+def test_retry_deadline(broker):
+    timeout = 1
+    deadline = 2.5
+    res = broker.execute("sleep", 5, timeout=timeout, deadline=deadline, retry=10)
+    with Timer() as t:
+        with pytest.raises(errors.Timeout):
+            res.result
+    assert t.elapsed < deadline + 0.5
+    assert len(res.attempt_timers) in {2, 3}
+
+
+def test_hedging_single_worker(broker):
+    broker.idempotent_services = ["echo"]
+    broker.hedge_delay = 0.01
+    res = broker.execute("echo", "foo")
+    assert res.result == ["foo"]
+    assert res.hedge_winner is None
+
+    res = broker.execute("echo", "foo", hedge="p95")
+    assert res.result == ["foo"]
+
+
+class TwoWorkers(object):
+    def service_url(self, service, exclude=(), hosts=None):
+        for url in ["http://primary/services/echo", "http://hedge/services/echo"]:
+            if url not in exclude:
+                return url
+
+
+@pytest.mark.parametrize("slow_primary", [True, False])
+def test_hedging_cancels_loser(monkeypatch, slow_primary):
+    monkeypatch.setenv("SERVICELIB_CONFIG_URL", "file:///dev/null")
+    monkeypatch.setattr(registry, "instance", TwoWorkers)
+    threads = set()
+    cancelled = []
+
+    def attempt(self, url, timeout, cancellation=None):
+        threads.add(threading.current_thread())
+        slow = ("primary" in url) == slow_primary
+        started = time.time()
+        while slow and time.time() - started < 5:
+            if cancellation.cancelled:
+                cancelled.append(url)
+                return errors.CommError("Cancelled")
+            time.sleep(0.01)
+        return core.Response([url], Metadata("echo"))
+
+    monkeypatch.setattr(client.Result, "_attempt", attempt)
+    with Timer() as t:
+        res = client.Result(
+            None, "echo", ("foo",), {}, None, client.executor(), hedge=0.1
+        )
+        res.wait()
+    assert t.elapsed < 2
+
+    if slow_primary:
+        assert res.hedge_winner == "hedge"
+        assert res.result == ["http://hedge/services/echo"]
+        assert cancelled == ["http://primary/services/echo"]
+        assert len(threads) == 2
+    else:
+        # The hedge was never sent.
+        assert res.hedge_winner is None
+        assert res.result == ["http://primary/services/echo"]
+        assert len(threads) == 1
+
+
+def test_hedging_only_idempotent_services(broker):
+    broker.idempotent_services = ["echo"]
+    broker.hedge_delay = 0.01
+    assert broker.execute("echo", "foo").hedge == 0.01
+    assert broker.execute("echo", "foo", hedge=False).hedge is None
+    assert broker.execute("dump_request", "foo", hedge=0.5).hedge is None
+
+
 def test_timeout_in_call(broker):
     timeout = 1
     delay = timeout + 0.5
@@ -198,3 +505,119 @@ def test_command_line_script(worker, monkeypatch, script_runner):
 
     r = script_runner.run("servicelib-client", "no-such-service")
     assert not r.success
+
+
+@pytest.fixture
+def local_service(servicelib_yaml, monkeypatch):
+    def execute(context, *args):
+        if args and args[0] == "raise":
+            raise ValueError("Nope")
+        return {"args": args, "type": type(args[0]).__name__ if args else None}
+
+    instance = service.ServiceInstance("in-process", execute=execute)
+    monkeypatch.setitem(service.service_instances(), "in-process", instance)
+    return instance
+
+
+def test_in_process_call(local_service):
+    b = client.Broker()
+    res = b.execute("in-process", (1, 2), {"a": 1})
+    assert res.url == "local:in-process"
+    # Arguments go through a JSON round trip, as they would over HTTP.
+    assert res.result == {"args": [[1, 2], {"a": 1}], "type": "list"}
+    assert b.execute("in-process", {1: "a"}).result == {
+        "args": [{"1": "a"}],
+        "type": "dict",
+    }
+    assert res.metadata.as_dict()["kids"][0]["task"] == "in-process"
+
+    with pytest.raises(errors.TaskError) as exc:
+        b.execute("in-process", "raise").result
+    assert "Nope" in str(exc.value)
+
+    results = b.execute_batch([("in-process", [42])])
+    assert results[0].result == {"args": [42], "type": "int"}
+
+
+def test_nested_in_process_calls(servicelib_yaml, monkeypatch):
+    b = client.Broker()
+    b.executor = client.DaemonThreadPoolExecutor(2)
+
+    def inner(context, n):
+        return n * 2
+
+    def outer(context, n):
+        time.sleep(0.2)
+        return b.execute("inner", n).result
+
+    for name, execute in [("inner", inner), ("outer", outer)]:
+        instance = service.ServiceInstance(name, execute=execute)
+        monkeypatch.setitem(service.service_instances(), name, instance)
+
+    results = [b.execute("outer", n) for n in range(4)]
+    assert [r.wait(timeout=10)[0] for r in results] == [0, 2, 4, 6]
+
+
+def test_in_process_timeout(servicelib_yaml, monkeypatch):
+    def execute(context, delay):
+        time.sleep(delay)
+        return delay
+
+    instance = service.ServiceInstance("in-process-sleep", execute=execute)
+    monkeypatch.setitem(service.service_instances(), "in-process-sleep", instance)
+    b = client.Broker()
+    with Timer() as t:
+        with pytest.raises(errors.Timeout):
+            b.execute("in-process-sleep", 3, timeout=0.5).result
+    assert t.elapsed < 2
+    assert b.execute("in-process-sleep", 0.1, timeout=2).result == 0.1
+
+
+def test_map_execute_errors(local_service, monkeypatch):
+    execute = client.Broker.execute
+
+    def failing_execute(self, service_name, *args, **kwargs):
+        if args == ("fail",):
+            raise errors.CommError("No way")
+        return execute(self, service_name, *args, **kwargs)
+
+    monkeypatch.setattr(client.Broker, "execute", failing_execute)
+    b = client.Broker()
+    for ordered in [False, True]:
+        res = list(b.map("in-process", [1, "fail", 2], ordered=ordered))
+        if ordered:
+            assert [args for (args, _, _) in res] == [(1,), ("fail",), (2,)]
+        res = {args: (value, metadata) for (args, value, metadata) in res}
+        assert res[(1,)][0] == {"args": [1], "type": "int"}
+        assert res[(2,)][0] == {"args": [2], "type": "int"}
+        value, metadata = res[("fail",)]
+        assert isinstance(value, errors.CommError)
+        assert metadata is None
+
+
+def test_in_process_disabled(local_service, monkeypatch):
+    monkeypatch.setenv(*env_var("SERVICELIB_CLIENT_IN_PROCESS", "false"))
+    assert client.local_instance("in-process") is None
+
+
+def test_media_types(monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(encoding, "_MEDIA_TYPES", None)
+    mt = client.MediaTypes()
+    assert mt.accept == ", ".join(
+        [
+            "application/vnd.servicelib.envelope+msgpack",
+            "application/vnd.servicelib.envelope+json;q=0.9",
+            "application/msgpack;q=0.8",
+            "application/json;q=0.7",
+        ]
+    )
+
+    url = "http://somewhere/services/foo"
+    assert mt.request_type(url) == encoding.JSON
+    mt.replied(url, encoding.MSGPACK)
+    assert mt.request_type(url) == encoding.MSGPACK
+    mt.replied(url, "text/html")
+    assert mt.request_type(url) == encoding.MSGPACK
+    mt.rejected(url)
+    assert mt.request_type(url) == encoding.JSON
@@ -12,6 +12,7 @@ from __future__ import absolute_import, unicode_literals
 import pytest
 
 from servicelib import core, errors
+from servicelib import encoding as json
 from servicelib.metadata import Metadata
 
 
@@ -37,3 +38,108 @@ def test_response_serialize_roundtrip(value):
     res = core.Response(value, Metadata("some-service"))
     ser = core.Response.from_http(res.http_status, res.http_body, res.http_headers)
     assert ser == res
+
+
+def test_request_dict_roundtrip():
+    req = core.Request("foo", 42, 42.0, cache=False, tracker=core.tracker())
+    assert core.Request.from_dict(req.as_dict()) == req
+
+
+@pytest.mark.parametrize("d", [{"args": "foo"}, {"args": [], "kwargs": []}])
+def test_request_from_invalid_dict(d):
+    with pytest.raises(ValueError):
+        core.Request.from_dict(d)
+
+
+@pytest.mark.parametrize("value", ["some-value", errors.BadRequest("Oops"),])
+def test_response_dict_roundtrip(value):
+    res = core.Response(value, Metadata("some-service"))
+    ser = core.Response.from_dict(json.loads(json.dumps(res.as_dict())))
+    assert ser == res
+
+
+@pytest.mark.parametrize(
+    "media_type",
+    [json.JSON, json.MSGPACK, json.ENVELOPE_JSON, json.ENVELOPE_MSGPACK],
+)
+def test_serialize_roundtrip_media_types(media_type):
+    if json.unwrap(media_type) == json.MSGPACK:
+        pytest.importorskip("msgpack")
+
+    req = core.Request({"a": [1, 2.5, None]}, "é", tracker=core.tracker())
+    ser = core.Request.from_http(req.encode(media_type), req.http_headers, media_type)
+    assert ser == req
+
+    res = core.Response({"a": [1, 2.5, None]}, Metadata("some-service"))
+    assert res.encode([media_type])[0] == media_type
+    ser = core.Response.from_http(
+        res.http_status, res.encode([media_type])[1], res.http_headers, media_type
+    )
+    assert ser == res
+
+
+def test_response_encode_falls_back():
+    pytest.importorskip("msgpack")
+    res = core.Response([2 ** 70], Metadata("some-service"))
+    assert res.encode([json.MSGPACK, json.JSON]) == (
+        json.JSON,
+        b"[1180591620717411303424]",
+    )
+    with pytest.raises(Exception):
+        core.Response(object(), Metadata("some-service")).encode([json.JSON])
+
+
+@pytest.mark.parametrize("media_type", [json.ENVELOPE_JSON, json.ENVELOPE_MSGPACK])
+def test_envelopes_need_no_headers(media_type):
+    if json.unwrap(media_type) == json.MSGPACK:
+        pytest.importorskip("msgpack")
+
+    req = core.Request([1, 2], uid="someone", tracker=core.tracker())
+    assert core.Request.from_http(req.encode(media_type), {}, media_type) == req
+
+    md = Metadata("some-service")
+    md.annotate("uid", "someone")
+    md.update_metadata(Metadata("some-other-service"))
+    for value in [{"a": [1.5]}, errors.BadRequest("Oops")]:
+        res = core.Response(value, md)
+        _, body = res.encode([media_type])
+        ser = core.Response.from_http(res.http_status, body, {}, media_type)
+        assert ser == res
+        assert ser.http_status == res.http_status
+
+
+@pytest.mark.parametrize(
+    "media_type", [json.JSON, json.MSGPACK, json.ENVELOPE_MSGPACK],
+)
+def test_responses_are_decoded_lazily(media_type):
+    if json.unwrap(media_type) == json.MSGPACK:
+        pytest.importorskip("msgpack")
+
+    res = core.Response({"a": [1.5]}, Metadata("some-service"))
+    _, body = res.encode([media_type])
+    ser = core.Response.from_http(200, body, res.http_headers, media_type)
+    assert not ser.decoded
+    assert ser.http_status == 200
+    assert repr(ser.metadata) == "LazyMetadata(<not loaded>)"
+
+    # Forwarded as they are, in whatever media type the caller prefers.
+    encoded = ser.encoded_value()
+    assert encoded.media_type == json.unwrap(media_type)
+    assert encoded.decode() == {"a": [1.5]}
+    fwd = core.Response(encoded, Metadata("some-proxy"))
+    other = json.JSON if encoded.media_type == json.MSGPACK else json.MSGPACK
+    assert fwd.encode([other, encoded.media_type]) == (
+        encoded.media_type,
+        encoded.data,
+    )
+    assert not ser.decoded and not fwd.decoded
+
+    assert ser == res
+    assert ser.decoded
+
+
+def test_errors_are_decoded_eagerly():
+    res = core.Response(errors.BadRequest("Oops"), Metadata("some-service"))
+    ser = core.Response.from_http(res.http_status, res.http_body, res.http_headers)
+    assert ser.decoded
+    assert ser.http_status == 400
@@ -0,0 +1,264 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import json
+import math
+import uuid
+
+import pytest
+
+from servicelib import encoding, errors
+from servicelib.metadata import Metadata
+
+
+@pytest.fixture(params=["json", "orjson", "rapidjson", "ujson"])
+def backend(request, monkeypatch):
+    try:
+        ret = encoding._instance(request.param)
+    except ImportError:
+        pytest.skip("{} not installed".format(request.param))
+    monkeypatch.setattr(encoding, "_BACKEND", ret)
+    return ret
+
+
+VALUES = [
+    None,
+    True,
+    42,
+    -(2 ** 63),
+    2 ** 64,
+    0.1,
+    1e-7,
+    1e16,
+    1.7976931348623157e308,
+    1792210249.6532998,
+    "",
+    "café ☃ \U0001f600",
+    "</script>",
+    [1, [2.5, {"a": "b"}]],
+    {"a": {"b": [None, 1.0]}, "é": 1},
+]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_roundtrip(backend, value):
+    encoded = encoding.dumps(value)
+    assert encoding.loads(encoded) == json.loads(encoded) == value
+    assert encoding.loads(encoding.dumpb(value)) == value
+
+
+def test_non_ascii_is_escaped(backend):
+    value = {"note": "café ☃ \U0001f600"}
+    assert json.loads(encoding.dumps(value)) == value
+    assert "\\u00e9 \\u2603 \\ud83d\\ude00" in encoding.dumps(value)
+    assert encoding.dumpb(value).decode("ascii")
+
+
+def test_floats_are_exact(backend):
+    for f in [0.1 + 0.2, 1 / 3.0, 5e-324, 123456789.123456789]:
+        assert repr(encoding.loads(encoding.dumps(f))) == repr(f)
+
+
+def test_as_dict(backend):
+    md = Metadata("some-service")
+    exc = errors.BadRequest("Oops")
+    assert encoding.loads(encoding.dumps([md, exc])) == [
+        json.loads(json.dumps(md.as_dict())),
+        json.loads(json.dumps(exc.as_dict())),
+    ]
+
+
+def test_unsupported_types(backend):
+    for value in [
+        object(),
+        datetime.datetime.now(),
+        {1, 2},
+        uuid.uuid4(),
+        {uuid.uuid4(): 1},
+    ]:
+        with pytest.raises(TypeError):
+            encoding.dumps(value)
+        with pytest.raises(TypeError):
+            encoding.dumpb(value)
+
+
+def test_unsupported_enums(backend):
+    enum = pytest.importorskip("enum")
+
+    class Colour(enum.Enum):
+        RED = 1
+
+    class Size(enum.IntEnum):
+        BIG = 2
+
+    for value in [Colour.RED, [{"a": Colour.RED}]]:
+        with pytest.raises(TypeError):
+            encoding.dumps(value)
+        with pytest.raises(TypeError):
+            encoding.dumpb(value)
+    assert encoding.dumps([Size.BIG]) == "[2]"
+
+
+def test_non_string_keys(backend):
+    assert encoding.loads(encoding.dumps({1: "a"})) == {"1": "a"}
+
+
+def test_nan(backend):
+    value = encoding.loads("[NaN]")[0]
+    assert math.isnan(value)
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), -float("inf")])
+def test_encode_nan(backend, value):
+    for encoded in [encoding.dumps({"a": [value]}), encoding.dumpb({"a": [value]})]:
+        assert repr(json.loads(encoded)["a"][0]) == repr(value)
+
+
+def test_orjson_floats(monkeypatch):
+    pytest.importorskip("orjson")
+    monkeypatch.setattr(encoding, "_BACKEND", encoding._instance("orjson"))
+    for f in [1e16, 1e-7, 0.00001, -7.5e-05, 1e300, 5e-324, 123.5, 1e-4]:
+        value = {"e1 0.00001": [f, '"1e5', 1, "8e-3\\", f]}
+        assert encoding.dumps(value) == json.dumps(value, separators=(",", ":"))
+
+
+def test_invalid_json(backend):
+    with pytest.raises(ValueError):
+        encoding.loads("[")
+
+
+def test_extra_args_use_stdlib(backend):
+    value = {"b": 1, "a": [1.5]}
+    assert encoding.dumps(value, sort_keys=True) == json.dumps(value, sort_keys=True)
+
+
+def test_auto_backend(monkeypatch):
+    monkeypatch.setattr(encoding, "_BACKEND", None)
+    assert encoding.backend().name != "orjson"
+
+
+def test_invalid_backend(monkeypatch):
+    monkeypatch.setattr(encoding, "_BACKEND", None)
+    monkeypatch.setenv("SERVICELIB_ENCODING_JSON_BACKEND", "nope")
+    with pytest.raises(Exception) as exc:
+        encoding.dumps(42)
+    assert str(exc.value) == "Invalid value for `encoding.json_backend`: nope"
+
+
+@pytest.mark.parametrize(
+    "content_type,expected",
+    [
+        (None, encoding.JSON),
+        ("", encoding.JSON),
+        ("application/json; charset=UTF-8", encoding.JSON),
+        ("Application/MsgPack", encoding.MSGPACK),
+        ("application/x-msgpack", encoding.MSGPACK),
+        ("text/plain", "text/plain"),
+    ],
+)
+def test_media_type(content_type, expected):
+    assert encoding.media_type(content_type) == expected
+
+
+def test_media_types(monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(encoding, "_MEDIA_TYPES", None)
+    assert encoding.media_types() == [
+        encoding.ENVELOPE_MSGPACK,
+        encoding.ENVELOPE_JSON,
+        encoding.MSGPACK,
+        encoding.JSON,
+    ]
+
+    monkeypatch.setattr(encoding, "_MEDIA_TYPES", None)
+    monkeypatch.setenv("SERVICELIB_ENCODING_ENVELOPE", "false")
+    assert encoding.media_types() == [encoding.MSGPACK, encoding.JSON]
+
+    monkeypatch.setattr(encoding, "_MEDIA_TYPES", None)
+    monkeypatch.setenv("SERVICELIB_ENCODING_MSGPACK", "false")
+    assert encoding.media_types() == [encoding.JSON]
+
+
+@pytest.mark.parametrize(
+    "accept,expected",
+    [
+        (None, [encoding.JSON]),
+        ("*/*", [encoding.JSON]),
+        ("text/html, application/*", [encoding.JSON]),
+        ("application/msgpack", [encoding.MSGPACK, encoding.JSON]),
+        (
+            "application/json, application/msgpack;q=0.5",
+            [encoding.JSON, encoding.MSGPACK],
+        ),
+        (
+            "application/msgpack;q=0.5, application/vnd.servicelib.envelope+json",
+            [encoding.ENVELOPE_JSON, encoding.MSGPACK, encoding.JSON],
+        ),
+        ("application/msgpack;q=0", [encoding.JSON]),
+    ],
+)
+def test_accepted(monkeypatch, accept, expected):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(encoding, "_MEDIA_TYPES", None)
+    assert encoding.accepted(accept) == expected
+
+
+@pytest.mark.parametrize("media_type", [encoding.JSON, encoding.MSGPACK])
+def test_encode_map(media_type):
+    if media_type == encoding.MSGPACK:
+        pytest.importorskip("msgpack")
+    items = [("a", encoding.encode([1.5, None], media_type))]
+    assert encoding.decode(encoding.encode_map(items, media_type), media_type) == {
+        "a": [1.5, None]
+    }
+    assert encoding.decode(encoding.encode_map([], media_type), media_type) == {}
+
+
+@pytest.mark.parametrize("value", VALUES[:4] + VALUES[5:])
+def test_msgpack_roundtrip(value):
+    pytest.importorskip("msgpack")
+    encoded = encoding.encode(value, encoding.MSGPACK)
+    assert encoding.decode(encoded, encoding.MSGPACK) == value
+
+
+@pytest.mark.parametrize(
+    "value",
+    [{1: "a"}, [{(1, 2): "a"}], b"bytes", {"a": [b"bytes"]}, b"", {"a": [b""]}],
+)
+def test_msgpack_json_semantics(value):
+    pytest.importorskip("msgpack")
+    with pytest.raises(TypeError):
+        encoding.encode(value, encoding.MSGPACK)
+
+
+def test_msgpack_strict_map_keys():
+    msgpack = pytest.importorskip("msgpack")
+    with pytest.raises(ValueError):
+        encoding.decode(msgpack.packb({1: "a"}), encoding.MSGPACK)
+
+
+def test_msgpack_as_dict():
+    pytest.importorskip("msgpack")
+    exc = errors.BadRequest("Oops")
+    encoded = encoding.encode(exc, encoding.MSGPACK)
+    assert encoding.decode(encoded, encoding.MSGPACK) == json.loads(
+        json.dumps(exc.as_dict())
+    )
+    with pytest.raises(TypeError):
+        encoding.encode(object(), encoding.MSGPACK)
+
+
+def test_unsupported_media_type():
+    with pytest.raises(ValueError):
+        encoding.encode(42, "text/plain")
+    with pytest.raises(ValueError):
+        encoding.decode(b"42", "text/plain")
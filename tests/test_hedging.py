@@ -0,0 +1,133 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+
+import pytest
+import requests
+
+from six.moves import BaseHTTPServer, socketserver
+
+from servicelib import hedging
+
+
+def test_percentile():
+    latencies = hedging.Latencies()
+    for i in range(hedging.MIN_SAMPLES - 1):
+        latencies.record("foo", float(i))
+    assert latencies.percentile("foo", 50) is None
+    assert latencies.percentile("bar", 50) is None
+
+    latencies = hedging.Latencies()
+    for i in range(101):
+        latencies.record("foo", float(100 - i))
+    assert latencies.percentile("foo", 50) == 50.0
+    assert latencies.percentile("foo", 95) == 95.0
+    assert latencies.percentile("foo", 99.9) == 100.0
+
+
+def test_window_size():
+    latencies = hedging.Latencies(size=hedging.MIN_SAMPLES)
+    for i in range(hedging.MIN_SAMPLES):
+        latencies.record("foo", 100.0)
+    for i in range(hedging.MIN_SAMPLES):
+        latencies.record("foo", 1.0)
+    assert latencies.percentile("foo", 99) == 1.0
+
+
+@pytest.mark.parametrize(
+    "spec,expected", [(0.5, (0.5, None)), ("2", (2.0, None)), ("p95", (None, 95.0))]
+)
+def test_parse_delay(spec, expected):
+    assert hedging.parse_delay(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["p0", "p100", "pfoo", "foo", None])
+def test_parse_invalid_delay(spec):
+    with pytest.raises(ValueError):
+        hedging.parse_delay(spec)
+
+
+def test_hedge_delay(monkeypatch):
+    latencies = hedging.Latencies()
+    monkeypatch.setattr(hedging, "_LATENCIES", latencies)
+    assert hedging.hedge_delay("foo", 0.25) == 0.25
+    assert hedging.hedge_delay("foo", "p90") is None
+    for i in range(101):
+        latencies.record("foo", i / 100.0)
+    assert hedging.hedge_delay("foo", "p90") == 0.9
+
+
+class SlowHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["content-length"]))
+        time.sleep(float(self.path.strip("/")))
+        self.send_response(200)
+        self.send_header("content-length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+@pytest.fixture
+def slow_url():
+    server = Server(("127.0.0.1", 0), SlowHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    try:
+        yield "http://127.0.0.1:{}".format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def session():
+    s = requests.Session()
+    s.mount("http://", hedging.CancellableAdapter())
+    try:
+        yield s
+    finally:
+        s.close()
+
+
+def test_cancellation(slow_url, session):
+    cancellation = hedging.Cancellation()
+    threading.Timer(0.2, cancellation.cancel).start()
+    started = time.time()
+    with pytest.raises(requests.ConnectionError):
+        with cancellation:
+            session.post(slow_url + "/5", data="x")
+    assert time.time() - started < 2
+
+    # Cancelled before being sent.
+    with pytest.raises(requests.ConnectionError):
+        with cancellation:
+            session.post(slow_url + "/0", data="x")
+
+    # Connections are not cancelled once the request is done.
+    cancellation = hedging.Cancellation()
+    with cancellation:
+        assert session.post(slow_url + "/0", data="x").content == b"ok"
+    cancellation.cancel()
+    assert session.post(slow_url + "/0", data="x").content == b"ok"
@@ -9,10 +9,126 @@
 
 from __future__ import absolute_import, unicode_literals
 
-from servicelib.metadata import Metadata
+from servicelib import encoding
+from servicelib.metadata import LazyMetadata, Metadata
 
 
 def test_roundtrip_encoding():
     m = Metadata("some-service")
     ser = Metadata.from_dict(m.as_dict())
     assert ser == m
+
+
+def test_kids_are_dropped_when_too_large(monkeypatch):
+    def make():
+        m = Metadata("some-service")
+        m.annotate("uid", "someone")
+        for i in range(50):
+            m.update_metadata(Metadata("kid-{}".format(i)))
+        return m
+
+    monkeypatch.setenv("SERVICELIB_METADATA_MAX_SIZE", "1000")
+    m = make()
+    headers = m.as_http_headers()
+    assert headers["kids"] == "[]"
+    assert headers["note-kids-dropped"] == "50"
+    assert headers["note-uid"] == '"someone"'
+
+    d = encoding.decode(m.encode(encoding.JSON))
+    assert d["kids"] == []
+    assert d["notes"] == {"uid": "someone", "kids-dropped": 50}
+
+    # Limits are read once per instance.
+    monkeypatch.setenv("SERVICELIB_METADATA_MAX_SIZE", "0")
+    assert m.as_http_headers()["kids"] == "[]"
+
+    m = make()
+    assert Metadata.from_dict(encoding.decode(m.encode(encoding.JSON))) == m
+
+
+def test_lazy_metadata():
+    m = Metadata("some-service")
+    m.annotate("uid", "someone")
+    calls = []
+    lazy = LazyMetadata(lambda: calls.append(1) or Metadata.from_dict(m.as_dict()))
+
+    parent = Metadata("some-proxy")
+    parent.update_metadata(lazy)
+    lazy.when_loaded(lambda md: md.annotate("attempts", 2))
+    assert not calls
+
+    assert lazy.as_dict()["notes"] == {"uid": "someone", "attempts": 2}
+    assert calls == [1]
+    assert parent.as_dict()["kids"] == [lazy.as_dict()]
+    lazy.when_loaded(lambda md: md.annotate("attempts", 3))
+    assert lazy._notes["attempts"] == 3
+    assert calls == [1]
+
+
+def make_kid(name, elapsed):
+    ret = Metadata(name)
+    ret.timer("elapsed").elapsed = elapsed
+    return ret
+
+
+def test_kids_are_summarised_past_max_kids(monkeypatch):
+    monkeypatch.setenv("SERVICELIB_METADATA_MAX_KIDS", "2")
+    m = Metadata("some-service")
+    for i in range(10):
+        m.update_metadata(make_kid("kid-{}".format(i % 2), float(i)))
+
+    d = m.as_dict()
+    assert [k["task"] for k in d["kids"]] == ["kid-0", "kid-1"]
+    assert d["summaries"] == {
+        "kid-0": {
+            "count": 4,
+            "timers": {"elapsed": {"count": 4, "min": 2.0, "max": 8.0, "sum": 20.0}},
+        },
+        "kid-1": {
+            "count": 4,
+            "timers": {"elapsed": {"count": 4, "min": 3.0, "max": 9.0, "sum": 24.0}},
+        },
+    }
+    assert Metadata.from_dict(d) == m
+    assert Metadata.from_http_headers(m.as_http_headers()) == m
+
+
+def test_kids_may_be_sampled(monkeypatch):
+    monkeypatch.setenv("SERVICELIB_METADATA_MAX_KIDS", "5")
+    monkeypatch.setenv("SERVICELIB_METADATA_SAMPLE_KIDS", "true")
+    m = Metadata("some-service")
+    for i in range(100):
+        m.update_metadata(make_kid("kid", float(i)))
+
+    d = m.as_dict()
+    assert len(d["kids"]) == 5
+    summary = d["summaries"]["kid"]
+    assert summary["count"] == 95
+    kept = sum(k["timers"]["elapsed"]["elapsed"] for k in d["kids"])
+    assert kept + summary["timers"]["elapsed"]["sum"] == sum(range(100))
+
+
+def test_deep_kids_are_summarised(monkeypatch):
+    def make():
+        m = Metadata("some-service")
+        kid = make_kid("kid", 1.0)
+        kid.update_metadata(make_kid("grandkid", 2.0))
+        kid.update_metadata(make_kid("grandkid", 3.0))
+        m.update_metadata(kid)
+        return m
+
+    monkeypatch.setenv("SERVICELIB_METADATA_MAX_DEPTH", "1")
+    m = make()
+    d = m.as_dict()
+    assert d["kids"][0]["kids"] == []
+    assert d["kids"][0]["summaries"] == {
+        "grandkid": {
+            "count": 2,
+            "timers": {"elapsed": {"count": 2, "min": 2.0, "max": 3.0, "sum": 5.0}},
+        }
+    }
+    assert "summaries" not in d
+
+    monkeypatch.setenv("SERVICELIB_METADATA_MAX_DEPTH", "0")
+    assert m.as_dict()["kids"][0]["kids"] == []
+    assert len(make().as_dict()["kids"][0]["kids"]) == 2
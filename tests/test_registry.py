@@ -9,10 +9,13 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import os
+import time
+
 import pytest
 
 from servicelib.compat import env_var
-from servicelib import registry
+from servicelib import circuit, errors, registry
 
 
 @pytest.fixture
@@ -56,3 +59,317 @@ def test_invalid_registry_factory(monkeypatch):
     with pytest.raises(Exception) as exc:
         registry.instance()
     assert str(exc.value) == "Invalid value for `registry.class`: no-such-impl"
+
+
+def test_open_circuits_are_skipped(redis_registry, monkeypatch):
+    monkeypatch.setattr(
+        circuit, "_BREAKERS", circuit.CircuitBreakers(failure_threshold=1)
+    )
+    redis_registry.register(
+        [
+            ("foo", "http://somewhere/services/foo"),
+            ("foo", "http://somewhere-else/services/foo"),
+        ]
+    )
+    circuit.breakers().record(
+        "http://somewhere/services/foo", errors.Timeout("somewhere")
+    )
+    for _ in range(10):
+        assert (
+            redis_registry.service_url("foo") == "http://somewhere-else/services/foo"
+        )
+
+    circuit.breakers().record(
+        "http://somewhere-else/services/foo", errors.Timeout("somewhere-else")
+    )
+    with pytest.raises(errors.CommError):
+        redis_registry.service_url("foo")
+
+
+def test_cache():
+    calls = []
+    fail = []
+
+    def fetch(k):
+        calls.append(k)
+        if fail:
+            raise Exception("Redis is down")
+        return "{}-{}".format(k, len(calls))
+
+    cache = registry.Cache(0.1, fetch)
+    assert cache.get("foo") == "foo-1"
+    assert cache.get("foo") == "foo-1"
+    assert calls == ["foo"]
+
+    # Stale values are returned while being refreshed.
+    time.sleep(0.2)
+    assert cache.get("foo") == "foo-1"
+    _wait_for(lambda: cache.get("foo") == "foo-2")
+
+    # The last known value is kept if refreshing fails.
+    fail.append(True)
+    time.sleep(0.2)
+    assert cache.get("foo") == "foo-2"
+    _wait_for(lambda: len(calls) == 3)
+    assert cache.get("foo") == "foo-2"
+
+    cache.invalidate("foo")
+    with pytest.raises(Exception) as exc:
+        cache.get("foo")
+    assert str(exc.value) == "Redis is down"
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_changes_are_pushed_to_caches(redis_registry, monkeypatch):
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_CACHE_TTL", "3600"))
+    other = registry.RedisRegistry()
+
+    redis_registry.register([("foo", "http://somewhere/services/foo")])
+    assert other.service_urls("foo") == ["http://somewhere/services/foo"]
+
+    redis_registry.register([("foo", "http://somewhere-else/services/foo")])
+    _wait_for(lambda: len(other.service_urls("foo")) == 2)
+
+    redis_registry.unregister(
+        [
+            ("foo", "http://somewhere/services/foo"),
+            ("foo", "http://somewhere-else/services/foo"),
+        ]
+    )
+    _wait_for(lambda: other.service_urls("foo") == [])
+
+
+def test_leases(redis_registry, monkeypatch):
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_CACHE_TTL", "0"))
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_LEASE_TTL", "0.5"))
+    r = registry.RedisRegistry()
+    alive = [("foo", "http://alive/services/foo")]
+    dead = [("foo", "http://dead/services/foo")]
+    r.register(alive + dead)
+    assert r.service_urls("foo") == [
+        "http://alive/services/foo",
+        "http://dead/services/foo",
+    ]
+
+    heartbeat = r.keep_alive(alive)
+    try:
+        time.sleep(1)
+        assert r.service_urls("foo") == ["http://alive/services/foo"]
+        assert redis_registry.services_by_name() == {
+            "foo": {"http://alive/services/foo"}
+        }
+    finally:
+        heartbeat.stop()
+
+
+def test_unleased_workers_are_not_reaped(redis_registry, monkeypatch):
+    unleased = [("foo", "http://unleased/services/foo")]
+    redis_registry.register(unleased)
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_CACHE_TTL", "0"))
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_LEASE_TTL", "0.5"))
+    r = registry.RedisRegistry()
+    leased = [("foo", "http://leased/services/foo")]
+    r.register(leased)
+    assert r.service_urls("foo") == ["http://leased/services/foo"]
+
+    time.sleep(1)
+    assert r.service_urls("foo") == []
+    assert redis_registry.services_by_name() == {
+        "foo": {"http://unleased/services/foo"}
+    }
+
+
+def test_heartbeat():
+    beats = []
+
+    class Registry(registry.Registry):
+        lease_ttl = 0.15
+
+        def heartbeat(self, services):
+            beats.append(services)
+
+    heartbeat = Registry().keep_alive([("foo", "http://foo")])
+    _wait_for(lambda: len(beats) >= 2)
+    assert beats[0] == [("foo", "http://foo")]
+
+    heartbeat.stop()
+    n = len(beats)
+    time.sleep(0.3)
+    assert len(beats) <= n + 1
+
+
+def test_services_by_name(redis_registry):
+    redis_registry.register(
+        [
+            ("foo", "http://somewhere/services/foo"),
+            ("foo", "http://somewhere-else/services/foo"),
+            ("bar", "http://somewhere/services/bar"),
+        ]
+    )
+    assert redis_registry.services_by_name() == {
+        "foo": {"http://somewhere/services/foo", "http://somewhere-else/services/foo"},
+        "bar": {"http://somewhere/services/bar"},
+    }
+
+    redis_registry.unregister([("bar", "http://somewhere/services/bar")])
+    assert set(redis_registry.services_by_name()) == {"foo"}
+
+
+def test_prefer_local():
+    local = "http://localhost:8000/services/foo"
+    remote = "http://somewhere-else:8000/services/foo"
+    assert registry.is_local(local)
+    assert not registry.is_local(remote)
+
+    assert registry.prefer_local([remote, local], 1) == [remote, local]
+    assert registry.prefer_local([remote, local], float("inf")) == [local, remote]
+    assert registry.prefer_local([remote], float("inf")) == [remote]
+
+    firsts = [registry.prefer_local([remote, local], 9)[0] for _ in range(1000)]
+    assert 800 < firsts.count(local) < 980
+    firsts = [registry.prefer_local([remote, local], 0)[0] for _ in range(100)]
+    assert firsts.count(local) == 0
+
+
+def test_prefer_hosts():
+    urls = [
+        "http://worker-1:8000/services/foo",
+        "http://worker-2.example.com:8000/services/foo",
+        "http://worker-3:8000/services/foo",
+    ]
+    assert registry.prefer_hosts(urls, []) == urls
+    assert registry.prefer_hosts(urls, ["worker-2"]) == [urls[1], urls[0], urls[2]]
+    assert registry.prefer_hosts(urls, ["worker-3.example.com", "worker-2"]) == [
+        urls[1],
+        urls[2],
+        urls[0],
+    ]
+
+
+def test_worker_load(redis_registry):
+    netloc = "somewhere:8000"
+    assert redis_registry.worker_load(netloc) is None
+    redis_registry.publish_load(
+        netloc, {"busy": 3, "threads": 4, "queue": 1, "cpu": 50.0}, 10
+    )
+    redis_registry._loads.invalidate(netloc)
+    assert redis_registry.worker_load(netloc) == {
+        "busy": 3,
+        "capacity": 4,
+        "queue": 1,
+        "cpu": 50.0,
+    }
+
+
+def test_memory_registry():
+    r = registry.MemoryRegistry()
+    r.register(
+        [
+            ("foo", "http://somewhere/services/foo"),
+            ("foo", "http://somewhere-else/services/foo"),
+            ("bar", "http://somewhere/services/bar"),
+        ]
+    )
+    assert r.service_url("bar") == "http://somewhere/services/bar"
+    r.unregister([("bar", "http://somewhere/services/bar")])
+    assert r.services_by_name() == {
+        "foo": {"http://somewhere/services/foo", "http://somewhere-else/services/foo"}
+    }
+    with pytest.raises(Exception) as exc:
+        r.service_url("bar")
+    assert str(exc.value) == "No URL for service bar"
+
+
+@pytest.mark.parametrize("fname", ["registry.json", "registry.yaml"])
+def test_file_registry(tmp_path, fname):
+    path = str(tmp_path / fname)
+    r = registry.FileRegistry(path)
+    assert r.services_by_name() == {}
+
+    r.register(
+        [
+            ("foo", "http://somewhere/services/foo"),
+            ("bar", "http://somewhere/services/bar"),
+        ]
+    )
+    other = registry.FileRegistry(path)
+    assert other.service_url("foo") == "http://somewhere/services/foo"
+
+    r.unregister([("bar", "http://somewhere/services/bar")])
+    other.check_interval = 0
+    assert other.services_by_name() == {"foo": {"http://somewhere/services/foo"}}
+
+    # Files may be edited by hand, too.
+    with open(path, "w") as f:
+        f.write("foo: http://elsewhere/services/foo\n")
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert other.service_urls("foo") == ["http://elsewhere/services/foo"]
+
+
+@pytest.mark.parametrize("kind", ["memory", "file"])
+def test_sockets(tmp_path, kind):
+    if kind == "memory":
+        r = registry.MemoryRegistry()
+    else:
+        r = registry.FileRegistry(str(tmp_path / "registry.json"))
+        r.check_interval = 0
+    assert r.socket_path("127.0.0.1:8000") is None
+    r.register_socket("127.0.0.1:8000", "/tmp/worker.sock")
+    assert r.socket_path("127.0.0.1:8000") == "/tmp/worker.sock"
+    r.unregister_socket("127.0.0.1:8000")
+    assert r.socket_path("127.0.0.1:8000") is None
+
+
+def test_file_registry_factory(tmp_path, monkeypatch):
+    path = tmp_path / "registry.yaml"
+    path.write_text("foo: [http://somewhere/services/foo]\n")
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_CLASS", "file"))
+    monkeypatch.setenv(*env_var("SERVICELIB_REGISTRY_PATH", str(path)))
+    monkeypatch.setitem(registry._INSTANCE_MAP, "file", registry.FileRegistry)
+    assert registry.instance().service_url("foo") == "http://somewhere/services/foo"
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Needs os.fork()")
+def test_periodic_restarts_after_fork(monkeypatch):
+    monkeypatch.setattr(registry, "_PERIODICS", [])
+    monkeypatch.setattr(registry, "_FORK_HOOKS_REGISTERED", False)
+    hooks = []
+    monkeypatch.setattr(
+        os, "register_at_fork", lambda **kwargs: hooks.append(kwargs), raising=False
+    )
+    r, w = os.pipe()
+    parent = os.getpid()
+
+    def func():
+        if os.getpid() != parent:
+            os.write(w, b"x")
+
+    periodics = [registry.Periodic(func, 0.05, "test-{}".format(i)) for i in range(2)]
+    for p in periodics:
+        p.start()
+        p.start()
+    assert registry._PERIODICS == periodics
+    assert len(hooks) == 1
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            hooks[0]["after_in_child"]()
+            time.sleep(0.5)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    os.close(w)
+    # Both threads ran in the child.
+    assert len(os.read(r, 4096)) >= 2 * 5
+    os.close(r)
+
+    for p in periodics:
+        p.stop()
+    assert registry._PERIODICS == []
@@ -221,3 +221,17 @@ def test_invalid_results_factory(monkeypatch):
     with pytest.raises(Exception) as exc:
         results.instance()
     assert str(exc.value) == "Invalid value for `results.class`: no-such-impl"
+
+
+def test_result_hosts():
+    r = {
+        "location": "http://worker-1.example.com:8000/results/foo.grib",
+        "contentType": "application/x-grib",
+        "contentLength": 42,
+    }
+    other = dict(r, location="http://worker-2:8000/results/bar.grib")
+    assert results.result_hosts([1, "foo", {"location": "x"}]) == set()
+    assert results.result_hosts([[r], {"x": {"y": other}}, r]) == {
+        "worker-1.example.com",
+        "worker-2",
+    }
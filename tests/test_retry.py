@@ -0,0 +1,66 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+import requests
+
+from servicelib import errors
+from servicelib.retry import RetryPolicy
+
+
+@pytest.mark.parametrize(
+    "exc,expected",
+    [
+        (errors.CommError("foo"), True),
+        (errors.Timeout("foo"), True),
+        (errors.RetryLater("foo", 0), True),
+        (requests.ConnectionError("foo"), True),
+        (errors.BadRequest("foo"), False),
+        (errors.TaskError("foo", ValueError, ValueError("foo"), None), False),
+        (ValueError("foo"), False),
+    ],
+)
+def test_retryable_errors(exc, expected):
+    assert RetryPolicy(max_attempts=2).should_retry(exc, 1) == expected
+
+
+def test_max_attempts():
+    p = RetryPolicy(max_attempts=3)
+    exc = errors.CommError("foo")
+    assert p.should_retry(exc, 1)
+    assert p.should_retry(exc, 2)
+    assert not p.should_retry(exc, 3)
+    assert not RetryPolicy().should_retry(exc, 1)
+
+
+def test_backoff():
+    p = RetryPolicy(max_attempts=10, backoff=0.5, max_backoff=3, jitter=False)
+    exc = errors.CommError("foo")
+    assert [p.delay(exc, i) for i in range(1, 6)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_backoff_with_jitter():
+    p = RetryPolicy(max_attempts=10, backoff=0.5, max_backoff=3)
+    exc = errors.CommError("foo")
+    for i in range(1, 6):
+        assert 0 <= p.delay(exc, i) <= min(3, 0.5 * 2 ** (i - 1))
+
+
+def test_retry_later_delay():
+    p = RetryPolicy(max_attempts=10, backoff=0.5)
+    assert p.delay(errors.RetryLater("foo", 7), 1) == 7.0
+
+
+def test_with_attempts():
+    p = RetryPolicy(backoff=0.5, max_backoff=3).with_attempts(5)
+    assert p.max_attempts == 5
+    assert p.backoff == 0.5
+    assert p.max_backoff == 3
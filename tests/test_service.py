@@ -120,6 +120,7 @@ def test_malformed_response(worker):
     exc = exc.value.exc_value
     assert isinstance(exc, TypeError)
     assert str(exc).startswith("Cannot encode")
+    assert " as application/json: " in str(exc)
 
 
 def test_process_based_service(worker):
@@ -0,0 +1,88 @@
+# (C) Copyright 2020- ECMWF.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# In applying this licence, ECMWF does not waive the privileges and immunities
+# granted to it by virtue of its status as an intergovernmental organisation
+# nor does it submit to any jurisdiction.
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+
+import pytest
+import requests
+
+from six.moves import BaseHTTPServer, socketserver
+
+from servicelib import unix
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["content-length"]))
+        reply = "{} {}".format(self.path, body.decode("utf-8")).encode("utf-8")
+        self.send_response(200)
+        self.send_header("content-length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def get_request(self):
+        # `BaseHTTPRequestHandler` expects a client address.
+        sock, _ = socketserver.UnixStreamServer.get_request(self)
+        return sock, ("local", 0)
+
+
+@pytest.fixture
+def socket_path():
+    d = tempfile.mkdtemp()
+    path = os.path.join(d, "worker.sock")
+    server = Server(path, Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    try:
+        yield path
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(d)
+
+
+def test_unix_url():
+    assert (
+        unix.unix_url("/run/servicelib/worker.sock", "http://foo:8000/services/bar")
+        == "http+unix://%2Frun%2Fservicelib%2Fworker.sock/services/bar"
+    )
+
+
+def test_post_over_unix_socket(socket_path):
+    s = requests.Session()
+    adapter = unix.UnixAdapter()
+    s.mount("http+unix://", adapter)
+    url = unix.unix_url(socket_path, "http://foo:8000/services/bar")
+    for i in range(3):
+        res = s.post(url, data="hello {}".format(i))
+        assert res.status_code == 200
+        assert res.text == "/services/bar hello {}".format(i)
+
+    # Connections are kept alive.
+    pool = adapter.unix_pools[socket_path]
+    assert pool.num_connections == 1
+    assert pool.num_requests == 3
+    s.close()